@@ -1,73 +1,227 @@
+import functools
 import pandas as pd
 import numpy as np
+import schema
+import parquet_store
+import parallel
+from monster_store import MonsterStore
+from outcome_index import OutcomeIndex
+from outcome_matrix import OutcomeMatrix
+from rollup import ElementCube, TORCH_BINS
+from identity import shared_identity
+import resample
 
 
+COMBO_COLUMNS = ["Parent 1 Species", "Parent 1 Level", "Parent 2 Species", "Parent 2 Level", "Torches", "Skin"]
 
-class Dataset:
-
-    def __init__(self, csv_file):
-        self.df = pd.read_csv(csv_file)
-        self.special_combos = pd.read_csv("other data/specials.csv")
-        self.monsters = pd.read_csv("other data/msm_monster_elements.csv")
-        self.parent1_species_col = self.get_col("Parent 1 Species")
-        self.parent2_species_col = self.get_col("Parent 2 Species")
-        self.parent1_level_col = self.get_col("Parent 1 Level")
-        self.parent2_level_col = self.get_col("Parent 2 Level")
-        self.result_col = self.get_col("Result")
-        self.torch_col = self.get_col("Torches")
-        self.skin_col = self.get_col("Titan")
-
-    def get_col(self, needle):
-        for col in self.df.columns:
-            if needle in col:
-                return self.df[col]
-
-    def remove_rarity(self, monster_name):
-        low = monster_name.lower()
-        if low.startswith("rare ") or low.startswith("epic ") or low.startswith("adult "):
-            return monster_name.split(" ", 1)[1]
-        return monster_name
-
-    def export_results_grouped_by_combo(self, output_file="grouped_results.csv"):
-        # groups results by unique variables, parents (order independent), levels, torch count, island skin
-        results = {}
+SPECIALS_CSV = "other data/specials.csv"
+MONSTER_ELEMENTS_CSV = "other data/msm_monster_elements.csv"
 
-        for index, row in self.df.iterrows():
 
-            p1 = self.remove_rarity(row[self.parent1_species_col.name])
-            p2 = self.remove_rarity(row[self.parent2_species_col.name])
+@functools.lru_cache(maxsize=None)
+def reference_table(csv_file):
+    # reference csvs are read the first time a Dataset asks for them and shared by every Dataset after, don't modify
+    return pd.read_csv(csv_file)
 
-            l1 = row[self.parent1_level_col.name]
-            l2 = row[self.parent2_level_col.name]
 
-            torches = row[self.torch_col.name]
-
-            skin = row[self.skin_col.name]
-
-            key = tuple(sorted([(p1, l1), (p2, l2)])) + (torches, skin)
+class Dataset:
 
-            result = row[self.result_col.name]
+    def __init__(self, source):
+        # source is a cleaned csv (msm_data.csv), a typed frame or a pyarrow Table. frames are used as they are, no copy
+        # a csv is typed in one pass: names are categoricals, levels/torches small ints, flags bools, date a datetime
+        if isinstance(source, pd.DataFrame):
+            self._load(source, schema.Schema(source.columns))
+        elif hasattr(source, "to_pandas") and hasattr(source, "schema"):
+            self._load(*parquet_store.from_arrow(source))
+        else:
+            self._load(*schema.read_cleaned(source))
+
+    @classmethod
+    def from_frame(cls, df, cols=None):
+        # a frame already in memory, typed like read_cleaned's (see schema.to_typed)
+        dataset = cls.__new__(cls)
+        dataset._load(df, cols if cols is not None else schema.Schema(df.columns))
+        return dataset
+
+    @classmethod
+    def from_parquet(cls, parquet_dir, columns=None, islands=None, start=None, end=None):
+        # reads the partitioned parquet export, only the given columns and only the islands/date range asked for
+        # e.g. Dataset.from_parquet("msm_data_parquet", islands=["Plant"], start="2025-09-01")
+        dataset = cls.__new__(cls)
+        dataset._load(*parquet_store.read_partitioned(parquet_dir, columns, islands, start, end))
+        return dataset
+
+    def _load(self, df, cols):
+        self.df, self.schema = df, cols
+        self._monster_store = None
+        self._outcome_index = None
+        self._element_cubes = {}
+        self.identity = shared_identity()  # MonsterIdentity, the pipeline's once it has validated
+        # columns left out of a projected read are None
+        self.parent1_species_col = self.get_col_by_name(cols.parent1)
+        self.parent2_species_col = self.get_col_by_name(cols.parent2)
+        self.parent1_level_col = self.get_col_by_name(cols.parent1_level)
+        self.parent2_level_col = self.get_col_by_name(cols.parent2_level)
+        self.result_col = self.get_col_by_name(cols.result)
+        self.torch_col = self.get_col_by_name(cols.torches)
+        self.skin_col = self.get_col_by_name(cols.skin)
+        self.date_col = self.get_col_by_name(cols.date)
+
+    def view(self, islands=None, start=None, end=None):
+        # Dataset of the rows on the given islands and between the inclusive start/end dates, sharing this one's
+        # reference tables and monster store, e.g. dataset.view(islands=["Plant"], start="2025-09-01")
+        keep = np.ones(len(self.df), dtype=bool)
+        if islands is not None:
+            keep &= self.df[self.schema.island].isin(list(islands)).to_numpy()
+        if start is not None:
+            keep &= (self.date_col >= pd.Timestamp(start)).to_numpy(dtype=bool, na_value=False)
+        if end is not None:
+            keep &= (self.date_col <= pd.Timestamp(end)).to_numpy(dtype=bool, na_value=False)
+        view = type(self).from_frame(self.df[keep].reset_index(drop=True), self.schema)
+        view._monster_store = self._monster_store
+        view.identity = self.identity
+        return view
+
+    @property
+    def special_combos(self):
+        return reference_table(SPECIALS_CSV)
+
+    @property
+    def monsters(self):
+        return reference_table(MONSTER_ELEMENTS_CSV)
+
+    def get_col_by_name(self, col):
+        return self.df[col] if col is not None else None
 
-            if key not in results:
-                results[key] = {"outcomes": {}}
-            if result not in results[key]["outcomes"]:
-                results[key]["outcomes"][result] = 0
+    def get_col(self, needle):
+        return self.get_col_by_name(self.schema.find(needle))
 
-            results[key]["outcomes"][result] += 1
+    @property
+    def monster_store(self):
+        # indexed element lookups, the scraper's sqlite store if it exists or else built in memory from the csv
+        if self._monster_store is None:
+            self._monster_store = MonsterStore.open()
+        return self._monster_store
 
-        output_rows = []
-        for key, value in results.items():
-            (p1, l1), (p2, l2), torches, skin = key
-            total_breeds = sum(value["outcomes"].values())
-            outcome_list = [(result, count) for result, count in value["outcomes"].items()]
-            output_rows.append((p1, l1, p2, l2, torches, skin, total_breeds, outcome_list))
+    def elements_of(self, species):
+        return self.monster_store.elements_of(species)
 
-        output_df = pd.DataFrame(
-            output_rows, columns=["Parent 1 Species", "Parent 1 Level", "Parent 2 Species", "Parent 2 Level", "Torches", "Skin", "Total Breeds", "Outcomes"]
-        )
+    def species_with_elements(self, elements, exact=False):
+        # e.g. species_with_elements(["Plant", "Cold"], exact=True) for every Plant+Cold two element monster
+        return self.monster_store.species_with_elements(elements, exact)
 
-        output_df.to_csv(output_file, index=False)
+    def remove_rarity(self, monster_name):
+        return self.identity.common_name(monster_name)
+
+    def remove_rarity_col(self, monster_names):
+        # vectorised remove_rarity for a whole column, a lookup of the column's identity codes
+        names = self.identity.name_array()[self.identity.common_codes(monster_names)]
+        return pd.Series(names, index=monster_names.index, name=monster_names.name)
+
+    def canonical_pairs(self):
+        # parents are order independent, so each pair is sorted by (species, level) with rarity removed. the common
+        # forms are compared by their rank among the identity table's names, the same order as comparing the strings
+        c1 = self.identity.common_codes(self.parent1_species_col)
+        c2 = self.identity.common_codes(self.parent2_species_col)
+        rank, names = self.identity.arrays()["rank"], self.identity.name_array()
+        r1, r2 = rank[c1], rank[c2]
+        p1, p2 = names[c1], names[c2]
+        # levels are swapped as the Int16 columns so a blank level stays blank instead of turning the column to float
+        l1, l2 = self.parent1_level_col, self.parent2_level_col
+        swap = (r1 > r2) | ((r1 == r2) & (l1 > l2).to_numpy(dtype=bool, na_value=False))
+        return pd.DataFrame({
+            "Parent 1 Species": np.where(swap, p2, p1),
+            "Parent 1 Level": l1.where(~swap, l2).array,
+            "Parent 2 Species": np.where(swap, p1, p2),
+            "Parent 2 Level": l2.where(~swap, l1).array,
+        }, index=self.df.index)
+
+    def combo_result_counts(self, row_offset=0):
+        # partial aggregate for export_results_grouped_by_combo, one row per (combo, result) with its count and the
+        # position of its first row. row_offset is the position of this frame's first row so parts can be merged
+        combos = self.canonical_pairs()
+        combos["Torches"] = self.torch_col.array
+        combos["Skin"] = self.skin_col.array
+        combos["Result"] = self.result_col.to_numpy(dtype=object)
+        combos["first"] = np.arange(row_offset, row_offset + len(combos))
+        grouped = combos.groupby(COMBO_COLUMNS + ["Result"], sort=False, dropna=False)
+        return grouped.agg(count=("first", "size"), first=("first", "min")).reset_index()
+
+    @staticmethod
+    def merge_combo_result_counts(parts):
+        # combines partial aggregates, e.g. of consecutive chunks, into one
+        counts = pd.concat(parts, ignore_index=True)
+        grouped = counts.groupby(COMBO_COLUMNS + ["Result"], sort=False, dropna=False)
+        return grouped.agg(count=("count", "sum"), first=("first", "min")).reset_index()
+
+    @staticmethod
+    def grouped_results(counts):
+        # one row per combo with its total and (result, count) outcomes, combos and their outcomes are listed in
+        # order of first appearance
+        counts = counts.assign(combo_first=counts.groupby(COMBO_COLUMNS, sort=False, dropna=False)["first"].transform("min"))
+        counts = counts.sort_values(["combo_first", "first"], kind="stable").reset_index(drop=True)
+
+        # splitting the flat (result, count) list at each combo boundary
+        combo_first = counts["combo_first"].to_numpy()
+        starts = np.flatnonzero(np.diff(combo_first, prepend=-1)) if len(counts) else np.array([], dtype=np.int64)
+        stops = np.append(starts[1:], len(counts)).astype(np.int64)
+        outcomes = list(zip(counts["Result"].tolist(), counts["count"].tolist()))
+
+        output_df = counts.loc[starts, COMBO_COLUMNS].reset_index(drop=True)
+        output_df["Total Breeds"] = np.add.reduceat(counts["count"].to_numpy(np.int64), starts) if len(counts) else np.array([], dtype=np.int64)
+        output_df["Outcomes"] = [outcomes[start:stop] for start, stop in zip(starts, stops)]
+        return output_df
+
+    def outcome_index(self):
+        # OutcomeIndex of the result counts per combo, built once, e.g.
+        # dataset.outcome_index().probability("Noggin", "Mammott", "Bowgart", torches=ANY, interval="jeffreys")
+        if self._outcome_index is None:
+            self._outcome_index = OutcomeIndex(self.combo_result_counts(), COMBO_COLUMNS, self.remove_rarity)
+        return self._outcome_index
+
+    def element_cube(self, torch_bins=TORCH_BINS):
+        # ElementCube of the breeds keyed by the parents' elements, built once per set of torch buckets, e.g.
+        # dataset.element_cube().rollup(["union", "torch_bucket", "result"])
+        torch_bins = tuple(torch_bins)
+        if torch_bins not in self._element_cubes:
+            self._element_cubes[torch_bins] = ElementCube(self, self.monsters, torch_bins)
+        return self._element_cubes[torch_bins]
+
+    def export_results_grouped_by_combo(self, output_file="grouped_results.csv", workers=1):
+        # groups results by unique variables, parents (order independent), levels, torch count, island skin
+        # workers > 1 counts shards of the rows in that many processes (0 for one per core), the output is the same
+        if workers == 1:
+            counts = self.combo_result_counts()
+        else:
+            counts = parallel.combo_result_counts(self.df, self.schema, workers)
+        self.grouped_results(counts).to_csv(output_file, index=False)
         print(f"Exported grouped results to {output_file}")
 
-
-
+    def export_outcome_matrix(self, output_dir="outcome_matrix"):
+        # the grouped results as memory-mappable sparse arrays, rows in the same order as grouped_results.csv
+        matrix = OutcomeMatrix.from_dataset(self)
+        matrix.save(output_dir)
+        print(f"Exported outcome matrix to {output_dir} ({matrix.shape[0]} combos x {matrix.shape[1]} results, {len(matrix.data)} outcomes)")
+
+    def rate_quantiles(self, method="bootstrap", samples=1000, quantiles=resample.QUANTILES, seed=0, workers=1):
+        # every combo result's breed rate with quantiles over resamples of all combos at once, see resample.py e.g.
+        # dataset.rate_quantiles("dirichlet", samples=10000, quantiles=(0.05, 0.95))
+        return resample.rate_quantiles(OutcomeMatrix.from_dataset(self), method, samples, quantiles, seed, workers=workers)
+
+    def export_candidate_outcomes(self, calendar, breeding, output_file="candidate_outcomes.csv", append=False):
+        # every attempt with the results that were possible on its date (event monsters only while available) and
+        # the bonanza multiplier active for them, calendar is an EventCalendar and breeding a BreedingIndex
+        # append adds the rows to an existing file without a header, for exporting chunk by chunk
+        candidates, multipliers = calendar.candidates(breeding, self.parent1_species_col, self.parent2_species_col, self.date_col)
+        result = breeding.codes(self.result_col)
+        names = breeding.species.to_numpy(dtype=object)
+
+        output_df = schema.for_export(self.df, self.schema)
+        output_df["Candidate Count"] = [len(codes) for codes in candidates]
+        output_df["Result Was Candidate"] = [code in codes for code, codes in zip(result, candidates)]
+        output_df["Bonanza Multiplier"] = multipliers
+        output_df["Candidate Outcomes"] = [", ".join(names[codes]) for codes in candidates]
+
+        output_df.to_csv(output_file, index=False, mode="a" if append else "w", header=not append)
+        if not append:
+            print(f"Exported candidate outcomes to {output_file} ({len(calendar)} calendar epochs)")
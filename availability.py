@@ -0,0 +1,112 @@
+import pandas as pd
+import numpy as np
+
+
+# availabilities.csv uses MM-DD-YYYY, the master sheet uses MM/DD/YYYY
+AVAILABILITY_DATE_FORMAT = "%m-%d-%Y"
+MSM_DATE_FORMAT = "%m/%d/%Y"
+
+
+# converts datetimes to whole days since epoch, NaT becomes -1 with a mask so callers can tell them apart
+def to_days(dates):
+    dates = pd.to_datetime(pd.Series(dates), errors="coerce")
+    missing = dates.isna().to_numpy()
+    days = dates.to_numpy().astype("datetime64[D]").astype(np.int64)
+    days[missing] = -1
+    return days, missing
+
+
+class AvailabilityIndex:
+    # sorted interval index of event windows for each event based monster
+    # every monster gets an integer code, intervals are merged per monster and stored as flat arrays sorted by
+    # (code, start) so a whole column of breeds can be checked with one searchsorted instead of a loop per row
+
+    def __init__(self, monsters, starts, stops):
+        # monsters/starts/stops are parallel lists, one entry per (monster, window)
+        windows = pd.DataFrame({"monster": monsters, "start": pd.to_datetime(pd.Series(starts), errors="coerce"),
+                                "stop": pd.to_datetime(pd.Series(stops), errors="coerce")})
+
+        # every monster listed is event based, even if all of its windows have unparseable dates
+        self.monsters = pd.Index(windows["monster"].unique())
+        windows["code"] = self.monsters.get_indexer(windows["monster"])
+
+        # windows with a missing start or stop can never match a date so are left out of the index
+        windows = windows.dropna(subset=["start", "stop"])
+        windows = windows[windows["start"] <= windows["stop"]]
+
+        codes = windows["code"].to_numpy(dtype=np.int64)
+        starts, _ = to_days(windows["start"])
+        stops, _ = to_days(windows["stop"])
+        self.codes, self.starts, self.stops = self._merge(codes, starts, stops)
+
+        # dates are packed into the low bits of a single int64 key alongside the monster code
+        self._base = int(self.starts.min()) if len(self.starts) else 0
+        self._keys_start = self._key(self.codes, self.starts)
+        self._keys_stop = self._key(self.codes, self.stops)
+
+    @classmethod
+    def from_csv(cls, csv_file):
+        df_avail = pd.read_csv(csv_file, header=0)
+        df_avail["startdate"] = pd.to_datetime(df_avail["startdate"], format=AVAILABILITY_DATE_FORMAT, errors="coerce")
+        df_avail["stopdate"] = pd.to_datetime(df_avail["stopdate"], format=AVAILABILITY_DATE_FORMAT, errors="coerce")
+        # one row per (window, monster)
+        df_avail["monsters"] = df_avail["monsters"].str.split(",")
+        df_avail = df_avail.explode("monsters")
+        df_avail["monsters"] = df_avail["monsters"].str.strip()
+        return cls(df_avail["monsters"].tolist(), df_avail["startdate"].tolist(), df_avail["stopdate"].tolist())
+
+    @staticmethod
+    def _merge(codes, starts, stops):
+        # sorts windows by (code, start) and merges any that overlap so each monster's windows are disjoint
+        if len(codes) == 0:
+            empty = np.array([], dtype=np.int64)
+            return empty, empty, empty
+        order = np.lexsort((starts, codes))
+        codes, starts, stops = codes[order], starts[order], stops[order]
+
+        # running max of stop within each monster, a new merged window starts when there is a gap
+        running = pd.Series(stops).groupby(codes).cummax().to_numpy()
+        new_window = np.ones(len(codes), dtype=bool)
+        new_window[1:] = (codes[1:] != codes[:-1]) | (starts[1:] > running[:-1])
+        window_id = np.cumsum(new_window) - 1
+
+        merged_stops = np.zeros(window_id[-1] + 1, dtype=np.int64)
+        np.maximum.at(merged_stops, window_id, stops)
+        return codes[new_window], starts[new_window], merged_stops
+
+    def _key(self, codes, days):
+        return (codes.astype(np.int64) << 32) + (days - self._base + (1 << 31))
+
+    def __len__(self):
+        return len(self.monsters)
+
+    def __contains__(self, monster):
+        return monster in self.monsters
+
+    def windows(self, monster):
+        # merged (start, stop) windows for a monster as timestamps, empty if the monster isn't event based
+        code = self.monsters.get_indexer([monster])[0]
+        mask = self.codes == code
+        return [(pd.Timestamp(int(start), unit="D"), pd.Timestamp(int(stop), unit="D"))
+                for start, stop in zip(self.starts[mask], self.stops[mask])]
+
+    def is_available(self, monsters, dates):
+        # returns a boolean array, True if the monster was available on the date (stop dates are inclusive)
+        # monsters that aren't event based are always available, event monsters with an invalid date never are
+        codes = self.monsters.get_indexer(pd.Series(monsters)).astype(np.int64)
+        days, missing = to_days(dates)
+
+        event = codes >= 0
+        ok = ~event
+        query = event & ~missing
+        if not query.any() or len(self._keys_start) == 0:
+            return ok
+
+        keys = self._key(codes[query], days[query])
+        # last window starting on or before the date, then check the date hasn't passed its stop
+        pos = np.searchsorted(self._keys_start, keys, side="right") - 1
+        hit = pos >= 0
+        pos = np.clip(pos, 0, None)
+        hit &= (self.codes[pos] == codes[query]) & (keys <= self._keys_stop[pos])
+        ok[query] = hit
+        return ok
@@ -0,0 +1,443 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import threading
+import filecmp
+import pandas as pd
+import numpy as np
+import Dataset
+import parallel
+from profiling import current_rss
+import rules
+import main
+import pipeline
+import schema
+from availability import AvailabilityIndex
+from breeding import BreedingIndex
+from identity import MonsterIdentity, split_rarity
+
+
+# run with "python benchmark.py" to time the vectorised steps on synthetic data shaped like the real files
+# each benchmark prints ns/row at increasing sizes, roughly constant ns/row means linear scaling
+
+AVAILABILITIES_CSV = "./other data/availabilities.csv"
+CLEANED_CSV = "msm_data.csv"
+MONSTER_ELEMENTS_CSV = "./other data/msm_monster_elements.csv"
+SPECIALS_CSV = "./other data/specials.csv"
+ISLANDS_CSV = "./other data/msm_islands_elements_monsters.csv"
+
+# rules main.py enables by default, every rule is timed but only these decide which rows are kept
+DEFAULT_RULES = ["date", "island", "skin", "torches", "parents", "levels", "result"]
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+# builds an index with at least n_windows windows by repeating the real event windows shifted forward a year at a time
+def synthetic_availability_index(n_windows):
+    real = AvailabilityIndex.from_csv(AVAILABILITIES_CSV)
+    monsters, starts, stops = [], [], []
+    year = 0
+    while len(monsters) < n_windows:
+        for code, start, stop in zip(real.codes, real.starts, real.stops):
+            monsters.append(real.monsters[code])
+            starts.append(pd.Timestamp(int(start), unit="D") + pd.DateOffset(years=year))
+            stops.append(pd.Timestamp(int(stop), unit="D") + pd.DateOffset(years=year))
+        year += 1
+    return AvailabilityIndex(monsters, starts, stops), year
+
+
+def bench_availability(row_counts, n_windows, seed=0):
+    index, years = synthetic_availability_index(n_windows)
+    rng = np.random.default_rng(seed)
+    # half of the results are event monsters, the rest are always available
+    names = np.concatenate([index.monsters.to_numpy(), np.array([f"Common {i}" for i in range(len(index))])])
+    first_day = int(index.starts.min())
+    print(f"availability: {len(index.codes)} merged windows over {years} years, {len(index)} event monsters")
+    for n in row_counts:
+        monsters = names[rng.integers(0, len(names), n)]
+        dates = pd.to_datetime(first_day + rng.integers(0, 365 * years, n), unit="D")
+        seconds, ok = timed(index.is_available, monsters, dates)
+        print(f"  {n:>10} rows  {seconds:8.3f}s  {seconds / n * 1e9:8.1f} ns/row  {ok.mean():.1%} available")
+
+
+# Dataset.remove_rarity as it was before the identity table, string work per name
+def legacy_remove_rarity(monster_name):
+    low = monster_name.lower()
+    if low.startswith("rare ") or low.startswith("epic ") or low.startswith("adult "):
+        return monster_name.split(" ", 1)[1]
+    return monster_name
+
+
+# the row by row implementation export_results_grouped_by_combo replaced, kept here as the reference for timings
+def legacy_export_results_grouped_by_combo(dataset, output_file):
+    results = {}
+    for index, row in dataset.df.iterrows():
+        p1 = legacy_remove_rarity(row[dataset.parent1_species_col.name])
+        p2 = legacy_remove_rarity(row[dataset.parent2_species_col.name])
+        l1 = row[dataset.parent1_level_col.name]
+        l2 = row[dataset.parent2_level_col.name]
+        torches = row[dataset.torch_col.name]
+        skin = row[dataset.skin_col.name]
+        key = tuple(sorted([(p1, l1), (p2, l2)])) + (torches, skin)
+        result = row[dataset.result_col.name]
+        if key not in results:
+            results[key] = {"outcomes": {}}
+        if result not in results[key]["outcomes"]:
+            results[key]["outcomes"][result] = 0
+        results[key]["outcomes"][result] += 1
+
+    output_rows = []
+    for key, value in results.items():
+        (p1, l1), (p2, l2), torches, skin = key
+        total_breeds = sum(value["outcomes"].values())
+        outcome_list = [(result, count) for result, count in value["outcomes"].items()]
+        output_rows.append((p1, l1, p2, l2, torches, skin, total_breeds, outcome_list))
+
+    pd.DataFrame(output_rows, columns=Dataset.COMBO_COLUMNS + ["Total Breeds", "Outcomes"]).to_csv(output_file, index=False)
+
+
+# resamples the real cleaned rows with replacement up to n rows so combos and outcomes keep a realistic spread
+def synthetic_cleaned_csv(n, output_file, seed=0):
+    real = pd.read_csv(CLEANED_CSV)
+    rng = np.random.default_rng(seed)
+    real.iloc[rng.integers(0, len(real), n)].to_csv(output_file, index=False)
+
+
+def bench_grouping(row_counts, legacy_max_rows, seed=0):
+    print("export_results_grouped_by_combo: vectorised vs legacy row loop")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in row_counts:
+            csv_file = os.path.join(tmp, "cleaned.csv")
+            synthetic_cleaned_csv(n, csv_file, seed)
+            dataset = Dataset.Dataset(csv_file)
+
+            new_file = os.path.join(tmp, "new.csv")
+            seconds, _ = timed(dataset.export_results_grouped_by_combo, new_file)
+            line = f"  {n:>10} rows  vectorised {seconds:8.3f}s  {seconds / n * 1e9:8.1f} ns/row"
+
+            # the legacy loop is far too slow at the larger sizes
+            if n <= legacy_max_rows:
+                old_file = os.path.join(tmp, "old.csv")
+                legacy_seconds, _ = timed(legacy_export_results_grouped_by_combo, dataset, old_file)
+                identical = filecmp.cmp(new_file, old_file, shallow=False)
+                line += f"  legacy {legacy_seconds:8.3f}s  {legacy_seconds / seconds:6.1f}x  identical={identical}"
+            print(line)
+
+
+# rebuilds a wiki Monsters page from msm_monster_elements.csv: the 12 monster tables in the wiki's cell markup,
+# followed by nav tables and filler so most of the page is content the scraper doesn't need, like the real one
+def synthetic_wiki_page(filler_blocks=4000):
+    import scrape
+    monsters = pd.read_csv(MONSTER_ELEMENTS_CSV)
+
+    def icon(title, src):
+        return f'<span typeof="mw:File"><a href="/wiki/{title}" title="{title}"><img src="https://static.wikia.nocookie.net/{src}.png" data-src="https://static.wikia.nocookie.net/{src}.png" width="30"></a></span>'
+
+    def cell(name, elements):
+        icons = ""
+        if not split_rarity(name)[0]:
+            for element in elements.split(", "):
+                base = element.replace(" (Primordial)", "")
+                base = "Mythical" if base.startswith("Mythical (") else base
+                title = base if base.lower() in scrape.KNOWN_ELEMENTS_MAP else f"{base} Element"
+                icons += " " + icon(title, ("Primordial_" if "(Primordial)" in element else "") + base.replace(" ", "_"))
+        return f'<td>{icon(name, name.replace(" ", "_"))}<br><a href="/wiki/{name}" title="{name}">{name}</a><br>{icons}</td>'
+
+    chunks = np.array_split(np.arange(len(monsters)), scrape.MONSTER_TABLES)
+    tables = []
+    for chunk in chunks:
+        cells = [cell(monsters["Species"][i], monsters["Elements"][i]) for i in chunk]
+        rows = ["<tr>" + "".join(cells[i:i + 6]) + "</tr>" for i in range(0, len(cells), 6)]
+        tables.append('<table class="article-table"><tbody><tr><th>Monster</th></tr>' + "".join(rows) + "</tbody></table>")
+    nav = ['<table class="article-table navbox"><tbody>' + f'<tr><td><a href="/wiki/Nav_{i}" title="Nav {i}">Nav {i}</a></td></tr>' * 50 + "</tbody></table>" for i in range(20)]
+    filler = [f'<div class="wds-dropdown"><ul><li><a href="/wiki/Page_{i}" title="Page {i}">Page {i}</a></li></ul><p>{"Lorem ipsum dolor sit amet. " * 8}</p></div>' for i in range(filler_blocks)]
+    half = len(filler) // 2
+    return "<html><head><script>" + "var x = 1;" * 2000 + "</script></head><body>" + "".join(filler[:half]) + "".join(tables) + "".join(nav) + "".join(filler[half:]) + "</body></html>"
+
+
+# the original scrape: whole page through html.parser, then each icon title worked out from scratch
+def legacy_parse_monster_elements(html):
+    from bs4 import BeautifulSoup
+    import scrape
+    tables = BeautifulSoup(html, "html.parser").select("table.article-table")[:scrape.MONSTER_TABLES]
+    return scrape.rows_from_tables(tables, element_map={})
+
+
+def bench_scrape(html_file=None, repeats=3):
+    # scrape.py needs bs4, imported here so the other suites run without it
+    import scrape
+    if html_file:
+        with open(html_file, encoding="utf-8") as f:
+            html = f.read()
+    else:
+        html = synthetic_wiki_page()
+    print(f"scrape: {len(html) / 1024:.0f} KiB page ({html_file or 'synthetic'}), best of {repeats}, parser {scrape.html_parser()}")
+    legacy_seconds = min(timed(legacy_parse_monster_elements, html)[0] for _ in range(repeats))
+    seconds = min(timed(scrape.parse_monster_elements, html)[0] for _ in range(repeats))
+    identical = legacy_parse_monster_elements(html).equals(scrape.parse_monster_elements(html))
+    print(f"  legacy {legacy_seconds:8.3f}s  filtered {seconds:8.3f}s  {legacy_seconds / seconds:6.1f}x  identical={identical}")
+
+
+# stage suite: a seeded synthetic master sheet run through each step of main.py, timed and memory profiled one
+# stage at a time. results go to json so runs on different commits can be compared with --compare
+
+SHEET_HEADER = (
+    'Source?,Date (MSM time) (MM/DD/YYYY),Time since reset (HH:MM:SS),"Day? (Local, 6am-8pm)","Night? (Local, 6am-8pm)",'
+    'Torches Lit,Island,Titan skin?,Parent 1,,Parent 2,,Result Monster\n'
+    ',,,,,,,,Species,Level,Species,Level,\n'
+)
+
+
+def dirty(rng, values, rate, bad_values):
+    # replaces a fraction of values with bad ones, like the mistakes and blanks in the real sheet
+    values = values.astype(object)
+    hit = rng.random(len(values)) < rate
+    values[hit] = np.asarray(bad_values, dtype=object)[rng.integers(0, len(bad_values), hit.sum())]
+    return values
+
+
+def synthetic_sheet(n, seed=0):
+    # csv text shaped like the master sheet export: two header rows with unnamed level columns, text values, blanks
+    # and a few percent of dirty entries in every column
+    rng = np.random.default_rng(seed)
+    species = pd.read_csv(MONSTER_ELEMENTS_CSV)["Species"].to_numpy(dtype=object)
+    sources = np.array([f"breeder_{i}" for i in range(500)], dtype=object)
+    days = pd.Timestamp("2025-08-01") + pd.to_timedelta(rng.integers(0, 450, n), unit="D")
+    # few distinct dates, so format them once each
+    codes, uniques = pd.factorize(days)
+    dates = np.array([f"{d.month}/{d.day}/{d.year}" for d in uniques], dtype=object)[codes]
+    levels = lambda: dirty(rng, rng.integers(4, 21, n).astype(str), 0.01, ["", "25", "lvl 15"])
+    df = pd.DataFrame({
+        "source": dirty(rng, sources[np.minimum(rng.zipf(1.5, n), len(sources)) - 1], 0.01, [""]),
+        "date": dirty(rng, dates, 0.01, ["", "?", "31/31/2025", "soon"]),
+        "time": dirty(rng, np.full(n, "", dtype=object), 0.05, ["01:02:03", "12:00:00", "7:45:10"]),
+        "day": dirty(rng, np.where(rng.random(n) < 0.5, "True", "False"), 0.05, [""]),
+        "night": dirty(rng, np.where(rng.random(n) < 0.5, "True", "False"), 0.05, [""]),
+        "torches": dirty(rng, rng.integers(0, 11, n).astype(float).astype(str), 0.05, ["", "", "12", "eleven"]),
+        "island": dirty(rng, np.array(pipeline.ISLAND_NAMES, dtype=object)[rng.integers(0, len(pipeline.ISLAND_NAMES), n)], 0.03, ["plant", "m cold", "Unknown Isle", ""]),
+        "skin": dirty(rng, np.where(rng.random(n) < 0.3, "True", "False"), 0.05, ["", "yes"]),
+        "parent1": dirty(rng, species[rng.integers(0, len(species), n)], 0.005, ["Mamot", ""]),
+        "parent1_level": levels(),
+        "parent2": dirty(rng, species[rng.integers(0, len(species), n)], 0.005, ["Toe jamer", ""]),
+        "parent2_level": levels(),
+        "result": dirty(rng, species[rng.integers(0, len(species), n)], 0.005, ["Nogin", "?"]),
+    })
+    return SHEET_HEADER + df.to_csv(header=False, index=False)
+
+
+class PeakMemory:
+    # samples resident memory on a background thread while a stage runs, peak_mib is the highest sample above the
+    # starting point. unlike tracemalloc this doesn't slow down the stage being timed, but memory freed by an earlier
+    # stage and reused shows up as 0
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak_mib = None
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self._peak = max(self._peak, current_rss())
+
+    def __enter__(self):
+        self._start = current_rss()
+        if self._start is not None:
+            self._peak = self._start
+            self._done = threading.Event()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._start is not None:
+            self._done.set()
+            self._thread.join()
+            self.peak_mib = (max(self._peak, current_rss()) - self._start) / 2**20
+
+
+def measure(func, *args, memory=True):
+    # (seconds, peak extra resident MiB or None, result)
+    peak = PeakMemory()
+    if memory:
+        with peak:
+            start = time.perf_counter()
+            result = func(*args)
+            seconds = time.perf_counter() - start
+    else:
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+    return seconds, peak.peak_mib, result
+
+
+# a Pipeline with main.py's default options (and any overrides) set up for an already flattened sheet, so the coerce,
+# post-process and pseudonymize stages time the pipeline's own steps
+def stage_pipeline(cols, ctx, **overrides):
+    pipe = pipeline.Pipeline(main.options(STAGE_CACHE_DIR=None, **overrides))
+    pipe.schema = cols
+    pipe.parent_monsters, pipe.result_monsters = ctx["parent_monsters"], ctx["result_monsters"]
+    return pipe
+
+
+def coerce_stage(pipe, df):
+    return pipe._coerce(df)[0]
+
+
+def post_process_stage(pipe, cleaned):
+    return pipe._post_process(cleaned, {}, {}, quiet=True)
+
+
+def export_stage(cleaned, cols, csv_file):
+    schema.for_export(cleaned, cols).to_csv(csv_file, index=False)
+
+
+def group_stage(csv_file, output_file):
+    Dataset.Dataset(csv_file).export_results_grouped_by_combo(output_file)
+
+
+def stage_context():
+    species = pd.read_csv(MONSTER_ELEMENTS_CSV)["Species"].tolist()
+    return {
+        "island_names": pipeline.ISLAND_NAMES,
+        "parent_monsters": species,
+        "result_monsters": species,
+        "identity": MonsterIdentity(species),
+        "availabilities": AvailabilityIndex.from_csv(AVAILABILITIES_CSV),
+        "breeding": BreedingIndex.from_csv(MONSTER_ELEMENTS_CSV, SPECIALS_CSV, ISLANDS_CSV),
+    }
+
+
+def bench_stages(row_counts, seed=0, memory=True):
+    ctx = stage_context()
+    results = []
+    print("stages: seconds, ns/row" + (", peak resident MiB above the stage's start" if memory else ""))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in row_counts:
+            text = synthetic_sheet(n, seed)
+            csv_file, grouped_file = os.path.join(tmp, "cleaned.csv"), os.path.join(tmp, "grouped.csv")
+
+            def record(stage, func, *args):
+                seconds, peak, result = measure(func, *args, memory=memory)
+                results.append({"rows": n, "stage": stage, "seconds": seconds, "ns_per_row": seconds / n * 1e9, "peak_mib": peak})
+                line = f"  {n:>10} rows  {stage:<24} {seconds:8.3f}s  {seconds / n * 1e9:8.1f} ns/row"
+                print(line + (f"  {peak:9.1f} MiB" if peak is not None else ""))
+                return result
+
+            df = record("flatten", schema.read_sheet, text)
+            del text
+            cols = ctx["schema"] = schema.Schema(df.columns)
+            # post-process runs every post-processing option but the pseudonyms, which pseudonymize times on its own
+            pipe = stage_pipeline(cols, ctx, USE_SOURCE_PSEUDONYMS=False)
+            pseudonyms = stage_pipeline(cols, ctx, REMOVE_TIME_SINCE_RESET=False, RARE_PARENTS_AS_COMMON=False, USE_SOURCE_PSEUDONYMS=True)
+            typed = record("coerce", coerce_stage, pipe, df)
+            mask = np.zeros(len(typed), dtype=np.uint32)
+            for name in rules.RULES:
+                violations = record(f"validate:{name}", rules.evaluate, typed, [name], ctx).to_numpy()
+                if name in DEFAULT_RULES:
+                    mask |= violations
+            cleaned = typed[mask == 0].reset_index(drop=True)
+            cleaned = record("post-process", post_process_stage, pipe, cleaned)
+            cleaned = record("pseudonymize", post_process_stage, pseudonyms, cleaned)
+            record("export", export_stage, cleaned, cols, csv_file)
+            record("group", group_stage, csv_file, grouped_file)
+            del df, typed, cleaned
+    return results
+
+
+def bench_workers(row_counts, worker_counts, seed=0):
+    # validation (every rule) and grouped result counting split across processes, the output of each worker count is
+    # checked against the serial one
+    ctx = stage_context()
+    print("workers: seconds (speedup over 1 worker)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in row_counts:
+            df = schema.read_sheet(synthetic_sheet(n, seed))
+            cols = ctx["schema"] = schema.Schema(df.columns)
+            typed = coerce_stage(stage_pipeline(cols, ctx), df)
+            csv_file = os.path.join(tmp, "cleaned.csv")
+            export_stage(typed[rules.evaluate(typed, DEFAULT_RULES, ctx).to_numpy() == 0], cols, csv_file)
+            data = Dataset.Dataset(csv_file).df
+            steps = [
+                ("validate", lambda w: parallel.evaluate(typed, list(rules.RULES), ctx, w)),
+                ("group", lambda w: Dataset.Dataset.grouped_results(parallel.combo_result_counts(data, cols, w))),
+            ]
+            for step, func in steps:
+                serial = None
+                for workers in [1] + [w for w in worker_counts if w != 1]:
+                    start = time.perf_counter()
+                    result = func(workers)
+                    seconds = time.perf_counter() - start
+                    if serial is None:
+                        serial = (seconds, result)
+                    elif not result.equals(serial[1]):
+                        raise AssertionError(f"{step} with {workers} workers differs from 1 worker at {n} rows")
+                    print(f"  {n:>10} rows  {step:<10} {parallel.worker_count(workers):>3} workers {seconds:8.3f}s  ({serial[0] / seconds:4.2f}x)")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(results, json_file, seed):
+    report = {
+        "commit": git_commit(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "seed": seed,
+        "results": results,
+    }
+    with open(json_file, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Saved {len(results)} stage results to {json_file}")
+
+
+def compare_results(results, json_file):
+    # ratio of this run's time to a saved run's time for every (rows, stage) both have, above 1 is slower
+    with open(json_file) as f:
+        old = json.load(f)
+    old_seconds = {(r["rows"], r["stage"]): r["seconds"] for r in old["results"]}
+    print(f"compared to {json_file} (commit {old.get('commit')})")
+    for r in results:
+        before = old_seconds.get((r["rows"], r["stage"]))
+        if before:
+            print(f"  {r['rows']:>10} rows  {r['stage']:<24} {before:8.3f}s -> {r['seconds']:8.3f}s  {r['seconds'] / before:6.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the msm data cleaner")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 5_000_000])
+    parser.add_argument("--windows", type=int, default=5_000, help="number of event windows for the availability check")
+    parser.add_argument("--legacy-max-rows", type=int, default=100_000, help="largest size the legacy loops are timed at")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scrape-html", default=None, help="saved wiki page to time scrape.py on, e.g. from ./intermediary logs/wiki_cache (synthetic page if not given)")
+    parser.add_argument("--stages", action="store_true", help="run the per-stage pipeline suite instead")
+    parser.add_argument("--stage-rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000, 10_000_000], help="10M rows needs several GB of memory")
+    parser.add_argument("--workers", type=int, nargs="+", default=None, help="time validation and grouping with these worker counts instead, 0 for one per core")
+    parser.add_argument("--no-memory", action="store_true", help="don't sample memory while stages run")
+    parser.add_argument("--json", default=None, help="file to save the stage results to")
+    parser.add_argument("--compare", default=None, help="saved stage results to compare this run against")
+    args = parser.parse_args()
+
+    if args.workers:
+        bench_workers(args.stage_rows, args.workers, args.seed)
+    elif args.stages:
+        results = bench_stages(args.stage_rows, args.seed, memory=not args.no_memory)
+        if args.json:
+            save_results(results, args.json, args.seed)
+        if args.compare:
+            compare_results(results, args.compare)
+    else:
+        bench_availability(args.rows, args.windows, args.seed)
+        bench_grouping(args.rows, args.legacy_max_rows, args.seed)
+        bench_scrape(args.scrape_html)
@@ -0,0 +1,153 @@
+import pandas as pd
+import numpy as np
+from identity import RARITIES, shared_identity
+
+
+def split_elements(text):
+    if not isinstance(text, str):
+        return []
+    return [element.strip() for element in text.split(",") if element.strip()]
+
+
+class BreedingIndex:
+    # precomputed lookup of which results each pair of parents can breed (event availability isn't considered)
+    # every element gets one bit, so a species' element set is a uint64 mask. a breed is possible if:
+    #  - the result's elements are a subset of the parents' combined elements (this covers the parents themselves),
+    #    epic and adult monsters are excluded as they only come from specific combos
+    #  - or the parents' combined elements are exactly an island's elements and the result is one of its quad monsters
+    #  - or the (parents, result) combo is listed in specials.csv, parents are order and rarity independent
+    # all combined masks of every possible pair are enumerated up front into a (union x result) boolean table, so
+    # checking a whole column of breeds is a few array lookups
+    # names are turned into species codes and their rarity stripped through the shared MonsterIdentity (identity.py),
+    # once per distinct name
+
+    def __init__(self, monsters, specials=None, islands=None, identity=None):
+        # monsters: Species/Elements frame (msm_monster_elements.csv), specials: parent1/parent2/result frame,
+        # islands: island/elements/monsters frame (msm_islands_elements_monsters.csv)
+        self.identity = identity if identity is not None else shared_identity()
+        self.species = pd.Index(monsters["Species"])
+        self._species_ids = self.identity.codes(pd.Series(self.species, dtype=object))
+        self._positions = None
+        element_lists = [split_elements(text) for text in monsters["Elements"]]
+        self.elements = pd.Index(sorted({element for elements in element_lists for element in elements}))
+        if len(self.elements) > 64:
+            raise ValueError(f"{len(self.elements)} elements don't fit in a 64 bit mask")
+        self.masks = np.array([self.element_mask(elements) for elements in element_lists], dtype=np.uint64)
+
+        # common form of each species, rarity removed (itself if the common form isn't listed)
+        self.common_ids = self.identity.arrays()["common"][self._species_ids]
+        common = self._codes_of_ids(self.common_ids)
+        self.common = np.where(common >= 0, common, np.arange(len(self.species)))
+
+        # every combined mask two parents can have, plus each island's full element set
+        unions = np.unique(self.masks[:, None] | self.masks[None, :])
+        island_quads = self._island_quads(islands)
+        self.unions = np.unique(np.concatenate([unions, np.array([mask for mask, _ in island_quads], dtype=np.uint64)]))
+
+        # (union, result) table, a result is breedable if none of its elements are outside the union
+        by_elements = ~np.isin(self.identity.arrays()["rarity"][self._species_ids], [RARITIES.index("epic"), RARITIES.index("adult")])
+        self.table = ((self.masks[None, :] & ~self.unions[:, None]) == 0) & by_elements[None, :]
+        for mask, results in island_quads:
+            self.table[np.searchsorted(self.unions, mask), results] = True
+
+        self.special_keys = self._special_keys(specials)
+
+    def element_mask(self, elements):
+        mask = 0
+        for element in elements:
+            mask |= 1 << int(self.elements.get_loc(element))
+        return mask
+
+    def _island_quads(self, islands):
+        # [(island element mask, [result species ids])] for islands listing both their elements and monsters
+        quads = []
+        if islands is None:
+            return quads
+        for row in islands.itertuples(index=False):
+            elements = split_elements(row.elements)
+            results = self.species.get_indexer(split_elements(row.monsters))
+            if not elements or any(element not in self.elements for element in elements):
+                continue
+            quads.append((np.uint64(self.element_mask(elements)), results[results >= 0]))
+        return quads
+
+    def _pair_keys(self, parent1, parent2, result):
+        # one int64 per (unordered common parents, result)
+        n = len(self.species)
+        low, high = np.minimum(parent1, parent2), np.maximum(parent1, parent2)
+        return (low.astype(np.int64) * n + high) * n + result
+
+    def _special_keys(self, specials):
+        if specials is None or len(specials) == 0:
+            return np.array([], dtype=np.int64)
+        parent1 = self._codes_of_ids(self.identity.common_codes(specials["parent1"]))
+        parent2 = self._codes_of_ids(self.identity.common_codes(specials["parent2"]))
+        result = self.codes(specials["result"])
+        known = (parent1 >= 0) & (parent2 >= 0) & (result >= 0)
+        return np.unique(self._pair_keys(parent1[known], parent2[known], result[known]))
+
+    @classmethod
+    def from_csv(cls, monsters_csv, specials_csv=None, islands_csv=None):
+        return cls(
+            pd.read_csv(monsters_csv),
+            pd.read_csv(specials_csv) if specials_csv else None,
+            pd.read_csv(islands_csv) if islands_csv else None,
+        )
+
+    def _codes_of_ids(self, ids):
+        # species codes of identity ids, -1 for names that aren't a listed species. rebuilt when the table has grown
+        if self._positions is None or len(self._positions) != len(self.identity) + 1:
+            self._positions = np.full(len(self.identity) + 1, -1, dtype=np.int64)
+            listed = self._species_ids >= 0
+            self._positions[self._species_ids[listed]] = np.flatnonzero(listed)
+        return self._positions[ids]
+
+    def codes(self, names):
+        names = names if isinstance(names, pd.Series) else pd.Series(names, dtype=object)
+        return self._codes_of_ids(self.identity.codes(names))
+
+    def common_names(self):
+        # each species' name with its rarity removed, listed or not
+        return self.identity.name_array()[self.common_ids]
+
+    def is_possible(self, parent1, parent2, result):
+        # boolean array, True if each breed was possible. rows with a species that has no element data can't be
+        # checked here and pass (the parents/result rules catch unknown names)
+        p1, p2, res = self.codes(parent1), self.codes(parent2), self.codes(result)
+        known = (p1 >= 0) & (p2 >= 0) & (res >= 0)
+        ok = ~known
+        p1, p2, res = p1[known], p2[known], res[known]
+
+        union = np.searchsorted(self.unions, self.masks[p1] | self.masks[p2])
+        possible = self.table[union, res]
+
+        # specials, matching the exact result or its common form (e.g. a rare of a special result)
+        c1, c2 = self.common[p1], self.common[p2]
+        for result_codes in (res, self.common[res]):
+            keys = self._pair_keys(c1, c2, result_codes)
+            pos = np.clip(np.searchsorted(self.special_keys, keys), 0, max(len(self.special_keys) - 1, 0))
+            if len(self.special_keys):
+                possible |= self.special_keys[pos] == keys
+
+        ok[known] = possible
+        return ok
+
+    def possible_mask(self, parent1_code, parent2_code):
+        # boolean array over species of every result the pair (species codes) could breed, same rules as is_possible
+        union = np.searchsorted(self.unions, self.masks[parent1_code] | self.masks[parent2_code])
+        possible = self.table[union].copy()
+        n = len(self.species)
+        c1, c2 = self.common[parent1_code], self.common[parent2_code]
+        pair = (min(c1, c2) * n + max(c1, c2)) * n
+        special = self.special_keys[(self.special_keys >= pair) & (self.special_keys < pair + n)] - pair
+        possible[special] = True
+        # rare/epic versions of special results
+        possible |= np.isin(self.common, special)
+        return possible
+
+    def possible_results(self, parent1, parent2):
+        # names of every result the pair could breed
+        p1, p2 = self.codes([parent1])[0], self.codes([parent2])[0]
+        if p1 < 0 or p2 < 0:
+            return []
+        return self.species[self.possible_mask(p1, p2)].tolist()
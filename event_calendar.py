@@ -0,0 +1,136 @@
+import pandas as pd
+import numpy as np
+from availability import AvailabilityIndex, AVAILABILITY_DATE_FORMAT, to_days
+
+
+def read_groups(csv_file):
+    # {group name: [monsters]} from groups.csv
+    groups = pd.read_csv(csv_file)
+    return {row["group name"]: [m.strip() for m in row["monsters"].split(",")] for _, row in groups.iterrows()}
+
+
+class EventCalendar:
+    # day by day calendar of which event monsters are available and which bonanza multipliers are active
+    # the calendar is cut at every day an event window or bonanza starts or ends, and each stretch of days with the same
+    # state is an epoch. epoch 0 is the state with no events running. identical stretches share one epoch id, so
+    # candidate outcomes are worked out once per (parent pair, epoch) rather than once per attempt
+
+    def __init__(self, availabilities, bonanzas=None, groups=None):
+        # availabilities: AvailabilityIndex, bonanzas: startdate/stopdate/group/multiplier frame, groups: {group: [monsters]}
+        self.availabilities = availabilities
+        self.groups = groups or {}
+        self.monsters = availabilities.monsters
+        self.bonanza_groups, bonanza_starts, bonanza_stops, bonanza_multipliers = self._bonanzas(bonanzas)
+
+        # window starts switch a monster/bonanza on, the day after a window's stop switches it off
+        starts = np.concatenate([availabilities.starts, bonanza_starts])
+        stops = np.concatenate([availabilities.stops, bonanza_stops]) + 1
+        self.boundaries = np.unique(np.concatenate([starts, stops]))
+
+        # running count of open windows per monster and per bonanza at each boundary
+        n_bounds = len(self.boundaries)
+        opened = np.zeros((n_bounds + 1, len(self.monsters)), dtype=np.int32)
+        np.add.at(opened, (np.searchsorted(self.boundaries, availabilities.starts), availabilities.codes), 1)
+        np.add.at(opened, (np.searchsorted(self.boundaries, availabilities.stops + 1), availabilities.codes), -1)
+        available = np.cumsum(opened, axis=0)[:n_bounds] > 0
+
+        multipliers = np.ones((n_bounds, len(self.bonanza_groups)))
+        for g, (start, stop, multiplier) in enumerate(zip(bonanza_starts, bonanza_stops, bonanza_multipliers)):
+            active = (self.boundaries >= start) & (self.boundaries <= stop)
+            multipliers[active, g] = np.maximum(multipliers[active, g], multiplier)
+
+        # deduplicating states into epochs, epoch 0 is nothing running (also used for dates outside the calendar)
+        epochs = {(np.packbits(np.zeros(len(self.monsters), dtype=bool)).tobytes(), tuple([1.0] * len(self.bonanza_groups))): 0}
+        self.epoch_available = [np.zeros(len(self.monsters), dtype=bool)]
+        self.epoch_multipliers = [np.ones(len(self.bonanza_groups))]
+        self.segment_epochs = np.zeros(n_bounds, dtype=np.int32)
+        for i in range(n_bounds):
+            key = (np.packbits(available[i]).tobytes(), tuple(multipliers[i]))
+            if key not in epochs:
+                epochs[key] = len(self.epoch_available)
+                self.epoch_available.append(available[i])
+                self.epoch_multipliers.append(multipliers[i])
+            self.segment_epochs[i] = epochs[key]
+        self._memo = {}
+
+    def _bonanzas(self, bonanzas):
+        if bonanzas is None or len(bonanzas) == 0:
+            return [], np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([])
+        starts, _ = to_days(pd.to_datetime(bonanzas["startdate"], format=AVAILABILITY_DATE_FORMAT, errors="coerce"))
+        stops, _ = to_days(pd.to_datetime(bonanzas["stopdate"], format=AVAILABILITY_DATE_FORMAT, errors="coerce"))
+        return list(bonanzas["group"]), starts, stops, bonanzas["multiplier"].to_numpy(dtype=float)
+
+    @classmethod
+    def from_csv(cls, availabilities_csv, bonanzas_csv=None, groups_csv=None):
+        bonanzas = pd.read_csv(bonanzas_csv) if bonanzas_csv else None
+        groups = read_groups(groups_csv) if groups_csv else None
+        return cls(AvailabilityIndex.from_csv(availabilities_csv), bonanzas, groups)
+
+    def __len__(self):
+        # number of distinct epochs
+        return len(self.epoch_available)
+
+    def epochs(self, dates):
+        # epoch id of each date, dates before/after the calendar or missing are epoch 0
+        days, missing = to_days(dates)
+        segment = np.searchsorted(self.boundaries, days, side="right") - 1
+        inside = (segment >= 0) & ~missing
+        out = np.zeros(len(days), dtype=np.int32)
+        out[inside] = self.segment_epochs[segment[inside]]
+        return out
+
+    def available_monsters(self, date):
+        epoch = self.epochs([date])[0]
+        return self.monsters[self.epoch_available[epoch]].tolist()
+
+    def active_multipliers(self, date):
+        epoch = self.epochs([date])[0]
+        return {group: float(m) for group, m in zip(self.bonanza_groups, self.epoch_multipliers[epoch]) if m != 1}
+
+    def _species_lookups(self, breeding):
+        # per species of the breeding index: which event monster it is (-1 if not event based) and which bonanza groups
+        # it belongs to, by its common name
+        if getattr(self, "_lookup_for", None) is not breeding:
+            self._event_code = self.monsters.get_indexer(breeding.species)
+            common = breeding.common_names()
+            self._group_members = np.array(
+                [[name in set(self.groups.get(group, [])) for name in common] for group in self.bonanza_groups], dtype=bool,
+            ).reshape(len(self.bonanza_groups), len(breeding.species))
+            self._lookup_for = breeding
+            self._memo = {}
+        return self._event_code, self._group_members
+
+    def candidate(self, breeding, parent1_code, parent2_code, epoch):
+        # (candidate species codes, bonanza multiplier) for a pair of parent codes in an epoch, memoised
+        c1, c2 = breeding.common[parent1_code], breeding.common[parent2_code]
+        key = (min(c1, c2), max(c1, c2), epoch)
+        if key not in self._memo:
+            event_code, group_members = self._species_lookups(breeding)
+            possible = breeding.possible_mask(parent1_code, parent2_code)
+            # event monsters are only candidates while one of their windows is open
+            available = event_code < 0
+            available[event_code >= 0] = self.epoch_available[epoch][event_code[event_code >= 0]]
+            candidates = possible & available
+
+            multiplier = 1.0
+            for g, group_multiplier in enumerate(self.epoch_multipliers[epoch]):
+                if group_multiplier != 1 and (candidates & group_members[g]).any():
+                    multiplier = max(multiplier, group_multiplier)
+            self._memo[key] = (np.flatnonzero(candidates), multiplier)
+        return self._memo[key]
+
+    def candidates(self, breeding, parent1, parent2, dates):
+        # candidate outcomes and bonanza multiplier for every attempt. attempts are reduced to distinct
+        # (parent1, parent2, epoch) first, so the work scales with distinct combos rather than rows
+        # returns (candidate species codes per attempt, multiplier per attempt), unknown parents get no candidates
+        self._species_lookups(breeding)
+        p1, p2 = breeding.codes(parent1), breeding.codes(parent2)
+        epochs = self.epochs(dates)
+        combos = pd.DataFrame({"p1": p1, "p2": p2, "epoch": epochs})
+        combo_id, uniques = pd.factorize(pd.MultiIndex.from_frame(combos))
+
+        empty = np.array([], dtype=np.int64)
+        per_combo = [self.candidate(breeding, a, b, e) if a >= 0 and b >= 0 else (empty, 1.0) for a, b, e in uniques]
+        candidate_codes = [per_combo[i][0] for i in combo_id]
+        multipliers = np.array([m for _, m in per_combo] + [1.0])[combo_id]
+        return candidate_codes, multipliers
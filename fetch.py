@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+import requests
+from requests.adapters import BaseAdapter
+
+
+def file_sha256(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sheet_url(sheet_id, gid):
+    return f"https://docs.google.com/spreadsheets/d/{sheet_id}/export?format=csv&gid={gid}"
+
+
+class SheetFetcher:
+    # fetches sheet exports through a shared session with an on-disk cache keyed by url
+    # a cached export younger than ttl seconds is used as is, an older one is revalidated with a conditional request
+    # (If-None-Match/If-Modified-Since) so an unchanged sheet costs a 304 instead of a full download
+    # fetch_file streams an export to disk in blocks instead, for sheets too big to hold in memory
+
+    def __init__(self, session, cache_dir=None, ttl=0, max_workers=4):
+        self.session = session
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_workers = max_workers
+        self.status = {}  # {url: "cached" | "not modified" | "downloaded"} for the last fetch of each url
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{key}.csv"), os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_meta(self, url):
+        # the cached export's meta, None unless both it and the export are cached. the export itself is only read
+        # when it is returned
+        if not self.cache_dir:
+            return None
+        body_path, meta_path = self._paths(url)
+        if not (os.path.exists(body_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _read_body(self, url):
+        with open(self._paths(url)[0], encoding="utf-8", newline="") as f:
+            return f.read()
+
+    def _write(self, path, content):
+        # written to a temp file first so a crash never leaves a half written export in the cache
+        with open(path + ".tmp", "w", encoding="utf-8", newline="") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+
+    def _write_meta(self, url, meta):
+        if self.cache_dir:
+            self._write(self._paths(url)[1], json.dumps(meta))
+
+    def _write_cache(self, url, text, meta):
+        if not self.cache_dir:
+            return
+        self._write(self._paths(url)[0], text)
+        self._write_meta(url, meta)
+
+    def _request(self, url, meta, stream=False):
+        # (response, None) for a new export, (None, "cached" or "not modified") if the cached one is still current.
+        # on a 304 only the meta is rewritten
+        if meta is not None and time.time() - meta["fetched_at"] < self.ttl:
+            return None, "cached"
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        resp = self.session.get(url, headers=headers, stream=stream)
+        if resp.status_code == 304 and meta is not None:
+            resp.close()
+            meta["fetched_at"] = time.time()
+            self._write_meta(url, meta)
+            return None, "not modified"
+        resp.raise_for_status()
+        return resp, None
+
+    @staticmethod
+    def _new_meta(url, resp):
+        return {
+            "url": url,
+            "etag": resp.headers.get("ETag"),
+            "last_modified": resp.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+        }
+
+    def fetch(self, url):
+        meta = self._read_meta(url)
+        resp, status = self._request(url, meta)
+        if resp is None:
+            self.status[url] = status
+            return self._read_body(url)
+        self._write_cache(url, resp.text, self._new_meta(url, resp))
+        self.status[url] = "downloaded"
+        return resp.text
+
+    def fetch_file(self, url, path=None, block_size=1 << 20):
+        # (path, sha256 of the export) with the export streamed to disk block by block, so it is never held in memory.
+        # it goes to the cache file, or to path when there's no cache dir
+        meta = self._read_meta(url)
+        resp, status = self._request(url, meta, stream=True)
+        if resp is None:
+            self.status[url] = status
+            body_path = self._paths(url)[0]
+            if not meta.get("sha256"):
+                # cached by fetch, which doesn't hash the export
+                meta["sha256"] = file_sha256(body_path, block_size)
+                self._write_meta(url, meta)
+            return body_path, meta["sha256"]
+
+        body_path = self._paths(url)[0] if self.cache_dir else path
+        digest = hashlib.sha256()
+        with resp, open(body_path + ".tmp", "wb") as f:
+            for block in resp.iter_content(block_size):
+                digest.update(block)
+                f.write(block)
+        os.replace(body_path + ".tmp", body_path)
+        self._write_meta(url, {**self._new_meta(url, resp), "sha256": digest.hexdigest()})
+        self.status[url] = "downloaded"
+        return body_path, digest.hexdigest()
+
+    def fetch_all(self, urls, files=None):
+        # fetches every url at once on a thread pool, returns {url: text} in the order given. urls in files are
+        # fetched with fetch_file instead, to their cache file or the path files maps them to, as (path, sha256)
+        files = files or {}
+
+        def fetch(url):
+            return self.fetch_file(url, files[url]) if url in files else self.fetch(url)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_workers, len(urls)))) as pool:
+            texts = list(pool.map(fetch, urls))
+        # printed after the pool finishes so output from the threads doesn't interleave
+        for url in urls:
+            print(f"{self.status[url].capitalize()}: {url}")
+        return dict(zip(urls, texts))
+
+
+class LocalSheetAdapter(BaseAdapter):
+    # file backed stand-in for the google sheets export endpoint, mount it on a session to run offline
+    # serves <sheet id>_<gid>.csv from a folder with an ETag of the file content and answers If-None-Match with a 304.
+    # stream=True requests read the file as the body is consumed, like a real download
+
+    def __init__(self, sheets_dir):
+        super().__init__()
+        self.sheets_dir = sheets_dir
+
+    def send(self, request, **kwargs):
+        parsed = urlparse(request.url)
+        parts = parsed.path.strip("/").split("/")
+        gid = parse_qs(parsed.query).get("gid", ["0"])[0]
+        resp = requests.Response()
+        resp.url = request.url
+        resp.request = request
+        resp.encoding = "utf-8"
+
+        # /spreadsheets/d/<sheet id>/export
+        path = None
+        if len(parts) >= 3 and parts[0] == "spreadsheets" and parts[1] == "d":
+            path = os.path.join(self.sheets_dir, f"{parts[2]}_{gid}.csv")
+        if path is None or not os.path.exists(path):
+            resp.status_code = 404
+            resp._content, resp._content_consumed = b"", True
+            return resp
+
+        etag = '"' + file_sha256(path)[:32] + '"'
+        resp.headers["ETag"] = etag
+        if request.headers.get("If-None-Match") == etag:
+            resp.status_code = 304
+            resp._content, resp._content_consumed = b"", True
+        elif kwargs.get("stream"):
+            resp.status_code = 200
+            resp.raw = open(path, "rb")
+        else:
+            resp.status_code = 200
+            with open(path, "rb") as f:
+                resp._content, resp._content_consumed = f.read(), True
+        return resp
+
+    def close(self):
+        pass
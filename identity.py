@@ -0,0 +1,121 @@
+import functools
+import os
+import numpy as np
+import pandas as pd
+from names import norm_key
+
+
+# one integer identity table for monster names, shared by scrape.py and the monster store, the pipeline's validation
+# rules and rarity option, BreedingIndex, the event calendar, Dataset and its ElementCube
+# every distinct spelling gets an id along with the id of its species (spellings equal under norm_key share one), of
+# its common form and a rarity code, so rarity stripping, validation and grouping are lookups into small arrays
+# indexed by a column's codes instead of string work per row. a column is converted once per distinct name
+
+RARITIES = ("", "rare", "epic", "adult")  # rarity codes 0-3, prefixes are matched in any case
+MONSTER_ELEMENTS_CSV = "other data/msm_monster_elements.csv"
+
+
+def split_rarity(name):
+    # (rarity code, name without its rarity prefix)
+    low = name.lower()
+    for code, prefix in enumerate(RARITIES[1:], 1):
+        if low.startswith(prefix + " "):
+            return code, name[len(prefix) + 1:]
+    return 0, name
+
+
+class MonsterIdentity:
+
+    def __init__(self, names=()):
+        self.names = []  # spelling of each id
+        self.ids = {}  # spelling -> id
+        self.species = []  # id of the first spelling of the same monster
+        self.common = []  # id of the common form, its own id for common monsters
+        self.rarity = []
+        self._species_by_key = {}
+        self._arrays = None
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        # sent to validation workers without the derived arrays
+        return {**self.__dict__, "_arrays": None}
+
+    def add(self, name):
+        # id of a spelling, added along with its common form if it is new
+        found = self.ids.get(name)
+        if found is not None:
+            return found
+        rarity, base = split_rarity(name)
+        common = self.add(base) if rarity else len(self.names)
+        i = len(self.names)
+        self.names.append(name)
+        self.ids[name] = i
+        self.species.append(self._species_by_key.setdefault(norm_key(name), i))
+        self.common.append(common)
+        self.rarity.append(rarity)
+        self._arrays = None
+        return i
+
+    def arrays(self):
+        # {"species", "common", "rarity", "rank"} as numpy arrays indexed by id, rank being the id's position in the
+        # sorted spellings. each ends with a -1 so the -1 code of a missing value looks up -1
+        if self._arrays is None:
+            rank = np.empty(len(self.names), dtype=np.int32)
+            rank[np.argsort(np.array(self.names, dtype=object), kind="stable")] = np.arange(len(self.names), dtype=np.int32)
+            self._arrays = {
+                "species": np.array(self.species + [-1], dtype=np.int32),
+                "common": np.array(self.common + [-1], dtype=np.int32),
+                "rarity": np.array(self.rarity + [-1], dtype=np.int8),
+                "rank": np.append(rank, -1).astype(np.int32),
+            }
+        return self._arrays
+
+    def codes(self, values):
+        # id of every value as an int32 array, -1 where missing. categorical columns are looked up per category
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, uniques = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        lookup = np.array([self.add(name) if isinstance(name, str) else -1 for name in uniques] + [-1], dtype=np.int32)
+        return lookup[codes]
+
+    def common_codes(self, values):
+        # codes first, they may add names and so rebuild the arrays
+        codes = self.codes(values)
+        return self.arrays()["common"][codes]
+
+    def rarity_codes(self, values):
+        codes = self.codes(values)
+        return self.arrays()["rarity"][codes]
+
+    def isin(self, values, names):
+        # bool array, whether each value is exactly one of names
+        codes = self.codes(values)
+        ids = [self.add(name) for name in names]
+        allowed = np.zeros(len(self.names) + 1, dtype=bool)
+        allowed[ids] = True
+        return allowed[codes]
+
+    def rarity_of(self, name):
+        return self.rarity[self.add(name)]
+
+    def common_name(self, name):
+        # name without its rarity prefix, doesn't add to the table
+        found = self.ids.get(name)
+        if found is not None:
+            return self.names[self.common[found]]
+        return split_rarity(name)[1] if isinstance(name, str) else name
+
+    def name_array(self):
+        return np.array(self.names + [None], dtype=object)
+
+
+@functools.lru_cache(maxsize=None)
+def shared_identity(csv_file=MONSTER_ELEMENTS_CSV):
+    # the table every module uses, seeded with the scraped species (empty before the first scrape). names met in the
+    # data are added as they come
+    return MonsterIdentity(pd.read_csv(csv_file)["Species"].dropna() if os.path.exists(csv_file) else ())
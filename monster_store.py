@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import sqlite3
+import pandas as pd
+from identity import shared_identity
+
+
+# sqlite store of the scraped monster data, written by scrape.py and read by Dataset
+# tables keeps the raw html hash and parsed cells of each wiki monster table so an unchanged table isn't parsed again,
+# monsters/elements hold the final rows with a content hash and the wiki revision each monster last changed in
+
+MONSTER_DB = "./intermediary logs/msm_monsters.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tables (position INTEGER PRIMARY KEY, hash TEXT NOT NULL, cells TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS monsters (
+    species TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    common TEXT NOT NULL,
+    elements TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    revision INTEGER
+);
+CREATE TABLE IF NOT EXISTS elements (species TEXT NOT NULL, element TEXT NOT NULL, PRIMARY KEY (species, element));
+CREATE INDEX IF NOT EXISTS elements_by_element ON elements (element);
+CREATE INDEX IF NOT EXISTS monsters_by_common ON monsters (common);
+CREATE TABLE IF NOT EXISTS mythical_overrides (monster TEXT PRIMARY KEY, island TEXT NOT NULL);
+"""
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def split_elements(text):
+    return [element.strip() for element in text.split(",") if element.strip()] if isinstance(text, str) else []
+
+
+class MonsterStore:
+
+    def __init__(self, db_file=MONSTER_DB):
+        self.conn = sqlite3.connect(db_file)
+        self.conn.executescript(SCHEMA)
+
+    @classmethod
+    def from_csv(cls, csv_file):
+        # in-memory store from msm_monster_elements.csv, for when the scraper's database isn't there
+        store = cls(":memory:")
+        store.upsert_monsters(pd.read_csv(csv_file))
+        store.commit()
+        return store
+
+    @classmethod
+    def open(cls, db_file=MONSTER_DB, csv_file="./other data/msm_monster_elements.csv"):
+        return cls(db_file) if os.path.exists(db_file) else cls.from_csv(csv_file)
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    # parse cache of the wiki tables
+
+    def table_cells(self, position, table_hash):
+        # the parsed cells stored for this table if its html hash is unchanged, else None
+        row = self.conn.execute("SELECT hash, cells FROM tables WHERE position = ?", (position,)).fetchone()
+        return json.loads(row[1]) if row and row[0] == table_hash else None
+
+    def set_table_cells(self, position, table_hash, cells):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO tables (position, hash, cells) VALUES (?, ?, ?)", (position, table_hash, json.dumps(cells)),
+        )
+
+    def truncate_tables(self, count):
+        self.conn.execute("DELETE FROM tables WHERE position >= ?", (count,))
+
+    # final monster rows
+
+    def upsert_monsters(self, df, revision=None):
+        # Species/Elements frame, only monsters whose elements changed are rewritten. returns (added, changed, removed)
+        stored = dict(self.conn.execute("SELECT species, hash FROM monsters").fetchall())
+        added = changed = 0
+        for position, (species, elements) in enumerate(zip(df["Species"], df["Elements"])):
+            elements = "" if pd.isna(elements) else elements
+            row_hash = content_hash(elements)
+            old = stored.pop(species, None)
+            if old == row_hash:
+                self.conn.execute("UPDATE monsters SET position = ? WHERE species = ?", (position, species))
+                continue
+            added, changed = (added + 1, changed) if old is None else (added, changed + 1)
+            common = shared_identity().common_name(species)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO monsters (species, position, common, elements, hash, revision) VALUES (?, ?, ?, ?, ?, ?)",
+                (species, position, common, elements, row_hash, revision),
+            )
+            self.conn.execute("DELETE FROM elements WHERE species = ?", (species,))
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO elements (species, element) VALUES (?, ?)",
+                [(species, element) for element in split_elements(elements)],
+            )
+        # monsters no longer on the page
+        for species in stored:
+            self.conn.execute("DELETE FROM monsters WHERE species = ?", (species,))
+            self.conn.execute("DELETE FROM elements WHERE species = ?", (species,))
+        return added, changed, len(stored)
+
+    def set_mythical_overrides(self, overrides):
+        self.conn.execute("DELETE FROM mythical_overrides")
+        self.conn.executemany("INSERT INTO mythical_overrides (monster, island) VALUES (?, ?)", list(overrides.items()))
+
+    def frame(self):
+        # Species/Elements frame in page order, as written to msm_monster_elements.csv
+        return pd.read_sql_query("SELECT species AS Species, elements AS Elements FROM monsters ORDER BY position", self.conn)
+
+    # lookups
+
+    def elements_of(self, species):
+        rows = self.conn.execute("SELECT element FROM elements WHERE species = ? ORDER BY rowid", (species,)).fetchall()
+        return [row[0] for row in rows]
+
+    def element_sets(self, species):
+        # {species: frozenset of elements} for many species in one query, unknown species are left out
+        species = list(dict.fromkeys(species))
+        found = {}
+        for start in range(0, len(species), 500):
+            batch = species[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT species, element FROM elements WHERE species IN ({','.join('?' * len(batch))})", batch,
+            ).fetchall()
+            for name, element in rows:
+                found.setdefault(name, set()).add(element)
+        return {name: frozenset(elements) for name, elements in found.items()}
+
+    def species_with_elements(self, elements, exact=False):
+        # species having every given element (and no others if exact), in page order
+        elements = list(dict.fromkeys(elements))
+        if not elements:
+            return []
+        placeholders = ",".join("?" * len(elements))
+        query = f"""
+            SELECT m.species FROM monsters m
+            JOIN elements e ON e.species = m.species AND e.element IN ({placeholders})
+            GROUP BY m.species HAVING COUNT(*) = ?
+        """
+        params = elements + [len(elements)]
+        if exact:
+            query += " AND (SELECT COUNT(*) FROM elements a WHERE a.species = m.species) = ?"
+            params.append(len(elements))
+        query += " ORDER BY m.position"
+        return [row[0] for row in self.conn.execute(query, params).fetchall()]
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
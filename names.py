@@ -0,0 +1,108 @@
+# monster/island name normalisation shared by scrape.py and the pipeline's name repair
+# NameIndex resolves near-miss names (case, spacing, curly quotes, small typos) to a known list using a BK-tree,
+# so repairing a column costs one lookup per distinct value rather than per row
+
+
+def norm_text(s: str) -> str:
+    if s is None:
+        return ""
+    return " ".join(s.replace("\xa0", " ").strip().split())
+
+
+# makes all quotes the same and lowercases
+def norm_key(name: str) -> str:
+    return norm_text(name).replace("\u2019", "'").replace("\u2018", "'").lower()
+
+
+def edit_distance(a, b, limit):
+    # levenshtein distance, anything above limit is returned as limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    # metric tree over strings, finds every key within a distance without comparing against all of them
+
+    def __init__(self, keys=()):
+        self.root = None
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        if self.root is None:
+            self.root = (key, {})
+            return
+        node = self.root
+        while True:
+            distance = edit_distance(key, node[0], len(key) + len(node[0]))
+            if distance == 0:
+                return
+            if distance not in node[1]:
+                node[1][distance] = (key, {})
+                return
+            node = node[1][distance]
+
+    def search(self, key, max_distance):
+        # [(distance, key)] of every key within max_distance, closest first
+        found = []
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node_key, children = nodes.pop()
+            distance = edit_distance(key, node_key, max_distance + len(node_key) + len(key))
+            if distance <= max_distance:
+                found.append((distance, node_key))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return sorted(found)
+
+
+class NameIndex:
+
+    def __init__(self, names, max_distance=2):
+        # names are the known spellings, max_distance the most edits a typo may be from one. names of 4-7 characters
+        # allow one edit and shorter ones none, where a single edit often gives another real name
+        self.names = set(names)
+        self.max_distance = max_distance
+        by_key = {}
+        for name in self.names:
+            by_key.setdefault(norm_key(name), set()).add(name)
+        # keys shared by two different known names are ambiguous and never repaired to
+        self.by_key = {key: next(iter(found)) for key, found in by_key.items() if len(found) == 1}
+        self.tree = BKTree(sorted(self.by_key))
+
+    def allowed_distance(self, key):
+        return min(self.max_distance, 0 if len(key) < 4 else 1 if len(key) < 8 else 2)
+
+    def repair(self, name):
+        # the known name this one was meant to be, or the name unchanged if it is known or has no single close match
+        if name in self.names or not isinstance(name, str):
+            return name
+        key = norm_key(name)
+        if key in self.by_key:
+            return self.by_key[key]
+        limit = self.allowed_distance(key)
+        if limit == 0:
+            return name
+        matches = self.tree.search(key, limit)
+        if not matches or (len(matches) > 1 and matches[1][0] == matches[0][0]):
+            return name
+        return self.by_key[matches[0][1]]
+
+    def repairs(self, values):
+        # {value: repaired name} for the distinct values that get changed
+        repaired = {}
+        for value in values:
+            new = self.repair(value)
+            if new != value:
+                repaired[value] = new
+        return repaired
@@ -0,0 +1,153 @@
+from collections import namedtuple
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+
+
+# indexed result counts per breeding combo, for P(result | parents, levels, torches, skin) lookups
+# built from Dataset.combo_result_counts. every set of wildcard dimensions gets its own hash table from combo key to
+# {result: count}, built the first time it's queried, after that each lookup is a couple of dict gets
+
+ANY = "*"  # wildcard for a query dimension, e.g. torches=ANY to pool every torch count
+
+Estimate = namedtuple("Estimate", ["count", "total", "probability", "low", "high"])
+
+
+def wilson_interval(count, total, confidence=0.95):
+    # (low, high) arrays, 0-1 where total is 0
+    count, total = np.asarray(count, dtype=float), np.asarray(total, dtype=float)
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = count / total
+        centre = (p + z * z / (2 * total)) / (1 + z * z / total)
+        half = z * np.sqrt(p * (1 - p) / total + z * z / (4 * total * total)) / (1 + z * z / total)
+    low = np.where((total == 0) | (count == 0), 0.0, np.clip(centre - half, 0, 1))
+    high = np.where((total == 0) | (count == total), 1.0, np.clip(centre + half, 0, 1))
+    return low, high
+
+
+def jeffreys_interval(count, total, confidence=0.95):
+    # (low, high) arrays from the Beta(count + 1/2, total - count + 1/2) posterior, needs scipy
+    try:
+        from scipy.special import betaincinv
+    except ImportError:
+        raise ImportError("scipy is required for Jeffreys intervals, install it with: pip install scipy")
+    count, total = np.asarray(count, dtype=float), np.asarray(total, dtype=float)
+    alpha = 1 - confidence
+    low = np.where(count == 0, 0.0, betaincinv(count + 0.5, total - count + 0.5, alpha / 2))
+    high = np.where(count == total, 1.0, betaincinv(count + 0.5, total - count + 0.5, 1 - alpha / 2))
+    return low, high
+
+
+INTERVALS = {"wilson": wilson_interval, "jeffreys": jeffreys_interval}
+
+
+def _is_any(value):
+    return isinstance(value, str) and value == ANY
+
+
+def _key_value(value):
+    # hashable value of a combo dimension, missing values are None
+    if value is None or value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, np.integer, float, np.floating)):
+        return int(value)
+    return value
+
+
+def _meet(a, b):
+    # (species, level) pattern matching what both a and b match, None if nothing can
+    out = []
+    for x, y in zip(a, b):
+        if _is_any(x) or x == y:
+            out.append(y)
+        elif _is_any(y):
+            out.append(x)
+        else:
+            return None
+    return tuple(out)
+
+
+class OutcomeIndex:
+
+    def __init__(self, counts, combo_columns, remove_rarity=None):
+        # counts has combo_columns (parent 1 species/level, parent 2 species/level, torches, skin) with parents in
+        # canonical order, plus Result and count. remove_rarity normalises queried species like the grouping does
+        self.combo_columns = list(combo_columns)
+        self.remove_rarity = remove_rarity or (lambda name: name)
+        counts = counts[self.combo_columns + ["Result", "count"]]
+        p1, l1, p2, l2 = self.combo_columns[:4]
+
+        # both parent orders of every combo so a pattern can match either, a combo of identical parents only once
+        same = ((counts[p1] == counts[p2]) & (counts[l1] == counts[l2])).fillna(False).to_numpy(dtype=bool)
+        swapped = counts[~same].rename(columns={p1: p2, l1: l2, p2: p1, l2: l1})
+        ordered = pd.concat([counts.assign(Same=same), swapped.assign(Same=False)], ignore_index=True)
+        self.ordered = ordered.astype({p1: object, p2: object, "Result": object})
+        self._tables = {}
+
+    def _table(self, kept, distinct=False):
+        # ({key: {result: count}}, {key: total}) over the combo columns flagged in kept, distinct only counts
+        # combos whose parents differ
+        if (kept, distinct) not in self._tables:
+            frame = self.ordered[~self.ordered["Same"]] if distinct else self.ordered
+            cols = [col for col, keep in zip(self.combo_columns, kept) if keep]
+            grouped = frame.groupby(cols + ["Result"], sort=False, dropna=False)["count"].sum().reset_index()
+            values = [[_key_value(v) for v in grouped[col].tolist()] for col in cols]
+            keys = list(zip(*values)) if cols else [()] * len(grouped)
+            table, totals = {}, {}
+            for key, result, count in zip(keys, grouped["Result"].tolist(), grouped["count"].tolist()):
+                table.setdefault(key, {})[_key_value(result)] = count
+                totals[key] = totals.get(key, 0) + count
+            self._tables[kept, distinct] = table, totals
+        return self._tables[kept, distinct]
+
+    def _pattern(self, parent1, level1, parent2, level2, torches, skin):
+        species = [p if _is_any(p) else self.remove_rarity(p) for p in (parent1, parent2)]
+        values = [species[0], level1, species[1], level2, torches, skin]
+        return tuple(v if _is_any(v) else _key_value(v) for v in values)
+
+    def _lookup(self, pattern, distinct=False):
+        kept = tuple(not _is_any(v) for v in pattern)
+        table, totals = self._table(kept, distinct)
+        key = tuple(v for v in pattern if not _is_any(v))
+        return table.get(key, {}), totals.get(key, 0)
+
+    def outcomes(self, parent1, parent2, level1=ANY, level2=ANY, torches=ANY, skin=ANY):
+        # ({result: count}, total breeds) of every recorded combo matching, parents in either order
+        pattern = self._pattern(parent1, level1, parent2, level2, torches, skin)
+        counts, total = self._lookup(pattern)
+        # a combo of two different parents both matching either side of the query was found in both orders
+        meet = _meet(pattern[0:2], pattern[2:4])
+        if meet is None:
+            return dict(counts), total
+        twice, twice_total = self._lookup(meet + meet + pattern[4:], distinct=True)
+        if not twice_total:
+            return dict(counts), total
+        counts = {result: count - twice.get(result, 0) // 2 for result, count in counts.items()}
+        return {result: count for result, count in counts.items() if count}, total - twice_total // 2
+
+    def probability(self, parent1, parent2, result, level1=ANY, level2=ANY, torches=ANY, skin=ANY,
+                    interval="wilson", confidence=0.95):
+        # Estimate of P(result | combo) with a confidence interval, wilson or jeffreys
+        counts, total = self.outcomes(parent1, parent2, level1, level2, torches, skin)
+        count = counts.get(result, 0)
+        low, high = INTERVALS[interval](count, total, confidence)
+        return Estimate(count, total, count / total if total else np.nan, float(low), float(high))
+
+    def query(self, queries, interval="wilson", confidence=0.95):
+        # batch probability: queries is a frame with a Result column and any of the combo columns, a missing column
+        # or ANY in it is a wildcard. returns a copy with Count, Total, Probability, Low and High columns
+        columns = [queries[col] if col in queries else pd.Series(ANY, index=queries.index) for col in self.combo_columns]
+        count, total = [], []
+        for row in zip(queries["Result"].tolist(), *(col.tolist() for col in columns)):
+            result, (parent1, level1, parent2, level2, torches, skin) = row[0], row[1:]
+            counts, n = self.outcomes(parent1, parent2, level1, level2, torches, skin)
+            count.append(counts.get(result, 0))
+            total.append(n)
+        count, total = np.array(count, dtype=np.int64), np.array(total, dtype=np.int64)
+        low, high = INTERVALS[interval](count, total, confidence)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            probability = np.where(total > 0, count / total, np.nan)
+        return queries.assign(Count=count, Total=total, Probability=probability, Low=low, High=high)
@@ -0,0 +1,136 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# the grouped results as a sparse combo x result count matrix in csr layout, written as a folder of raw .npy arrays
+# plus a small keys.json so downstream jobs can memory-map it and do vectorised probability maths instead of
+# literal_eval'ing the Outcomes column row by row. row i is the combo on row i of grouped_results.csv
+#
+#   indptr.npy   int64, combos + 1   row i's outcomes are indices/data[indptr[i]:indptr[i + 1]]
+#   indices.npy  int32               result of each outcome, a position in keys.json's results
+#   data.npy     int64               breeds of each outcome
+#   totals.npy   int64, combos       Total Breeds of each combo
+#   parent1.npy, parent2.npy  int32  combo parents, positions in keys.json's species
+#   level1.npy, level2.npy, torches.npy  int16, -1 if missing
+#   skin.npy     int8, 1 true, 0 false, -1 if missing
+#
+# blank results and parents are kept like grouped_results.csv keeps them, as a null name in keys.json
+
+MATRIX_VERSION = 1
+
+
+KEY_ARRAYS = ["parent1", "level1", "parent2", "level2", "torches", "skin"]
+ARRAYS = ["indptr", "indices", "data", "totals"] + KEY_ARRAYS
+
+
+def _codes(*columns):
+    # int32 codes of the values of columns into one sorted name list shared by all of them, blanks are coded like any
+    # other name and listed as None
+    codes, uniques = pd.factorize(pd.concat([col.astype(object) for col in columns], ignore_index=True), sort=True, use_na_sentinel=False)
+    names = [None if pd.isna(name) else name for name in uniques]
+    bounds = np.cumsum([0] + [len(col) for col in columns])
+    return [codes[start:stop].astype(np.int32) for start, stop in zip(bounds[:-1], bounds[1:])], names
+
+
+class OutcomeMatrix:
+
+    def __init__(self, arrays, species, results):
+        self.arrays = arrays  # {name: numpy array or memmap}
+        self.species = species
+        self.results = results
+        for name, values in arrays.items():
+            setattr(self, name, values)
+        self.shape = (len(self.indptr) - 1, len(results))
+
+    @classmethod
+    def from_counts(cls, counts):
+        # a Dataset.combo_result_counts frame, combos in the same order as Dataset.grouped_results
+        import Dataset
+        counts = counts.assign(combo_first=counts.groupby(Dataset.COMBO_COLUMNS, sort=False, dropna=False)["first"].transform("min"))
+        (result_codes,), results = _codes(counts["Result"])
+        counts = counts.assign(result_code=result_codes).sort_values(["combo_first", "result_code"], kind="stable").reset_index(drop=True)
+
+        combo_first = counts["combo_first"].to_numpy()
+        starts = np.flatnonzero(np.diff(combo_first, prepend=-1)) if len(counts) else np.array([], dtype=np.int64)
+        data = counts["count"].to_numpy(np.int64)
+        combos = counts.loc[starts]
+        (parent1, parent2), species = _codes(combos["Parent 1 Species"], combos["Parent 2 Species"])
+        skin = combos["Skin"].astype(object)
+        arrays = {
+            "indptr": np.append(starts, len(counts)).astype(np.int64),
+            "indices": counts["result_code"].to_numpy(np.int32),
+            "data": data,
+            "totals": np.add.reduceat(data, starts) if len(counts) else np.array([], dtype=np.int64),
+            "parent1": parent1,
+            "level1": combos["Parent 1 Level"].fillna(-1).to_numpy(np.int16),
+            "parent2": parent2,
+            "level2": combos["Parent 2 Level"].fillna(-1).to_numpy(np.int16),
+            "torches": combos["Torches"].fillna(-1).to_numpy(np.int16),
+            "skin": np.where(skin.isna(), -1, skin.fillna(False).astype(bool)).astype(np.int8),
+        }
+        return cls(arrays, species, results)
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        return cls.from_counts(dataset.combo_result_counts())
+
+    def save(self, output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+        for name in ARRAYS:
+            np.save(os.path.join(output_dir, name + ".npy"), np.ascontiguousarray(self.arrays[name]))
+        with open(os.path.join(output_dir, "keys.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": MATRIX_VERSION, "shape": list(self.shape), "species": self.species, "results": self.results}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, matrix_dir, mmap=True):
+        # the arrays are memory-mapped read only unless mmap is False, so opening it costs the same however big it is
+        with open(os.path.join(matrix_dir, "keys.json"), encoding="utf-8") as f:
+            keys = json.load(f)
+        if keys["version"] != MATRIX_VERSION:
+            raise ValueError(f"{matrix_dir} is a version {keys['version']} outcome matrix, expected {MATRIX_VERSION}")
+        mode = "r" if mmap else None
+        arrays = {name: np.load(os.path.join(matrix_dir, name + ".npy"), mmap_mode=mode) for name in ARRAYS}
+        return cls(arrays, keys["species"], keys["results"])
+
+    def __len__(self):
+        return self.shape[0]
+
+    def rows(self):
+        # combo row of each stored outcome
+        return np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+
+    def probabilities(self):
+        # data / the combo's total, aligned with indices
+        return self.data / np.repeat(self.totals, np.diff(self.indptr))
+
+    def combos(self):
+        # the key columns as a frame, like grouped_results.csv's first columns
+        species = np.array(self.species, dtype=object)
+        skin = np.asarray(self.skin)
+        return pd.DataFrame({
+            "Parent 1 Species": species[self.parent1],
+            "Parent 1 Level": np.asarray(self.level1),
+            "Parent 2 Species": species[self.parent2],
+            "Parent 2 Level": np.asarray(self.level2),
+            "Torches": np.asarray(self.torches),
+            "Skin": skin > 0 if (skin >= 0).all() else np.where(skin < 0, None, skin > 0).astype(object),
+        })
+
+    def outcomes(self, row):
+        # [(result, count)] of one combo row
+        start, stop = self.indptr[row], self.indptr[row + 1]
+        return [(self.results[code], int(count)) for code, count in zip(self.indices[start:stop], self.data[start:stop])]
+
+    def result_column(self, result):
+        # dense breeds of result for every combo row
+        column = np.zeros(self.shape[0], dtype=np.int64)
+        found = self.indices == self.results.index(result)
+        column[self.rows()[found]] = self.data[found]
+        return column
+
+    def to_scipy(self):
+        # scipy.sparse csr_matrix over the same arrays, scipy is only needed for this
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
@@ -0,0 +1,62 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import rules
+from profiling import NULL_TRACER
+
+
+# map-reduce over a process pool for the row-wise steps: validation and the grouped results' counting
+# rows are split into contiguous shards in order, each worker handles whole shards and the partial results are put
+# back together in shard order, so the output is the same as running serially whatever the worker count
+
+_context = None  # rule context, sent to each worker once rather than with every shard
+
+
+def _init_worker(ctx):
+    global _context
+    _context = ctx
+
+
+def shard_bounds(n, shards):
+    # [(start, stop)] of shards contiguous row ranges covering n rows
+    edges = np.linspace(0, n, shards + 1).astype(np.int64)
+    return [(int(start), int(stop)) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+
+def worker_count(workers):
+    # 0 means one per core
+    return (os.cpu_count() or 1) if workers == 0 else workers
+
+
+def _evaluate_shard(shard, rule_names):
+    return rules.evaluate(shard, rule_names, _context)
+
+
+def evaluate(df, rule_names, ctx, workers, tracer=NULL_TRACER):
+    # rules.evaluate with the rows split across workers processes, per rule spans are only traced in a single process
+    workers = worker_count(workers)
+    if workers <= 1 or len(df) < 2:
+        return rules.evaluate(df, rule_names, ctx, tracer)
+    shards = [df.iloc[start:stop] for start, stop in shard_bounds(len(df), workers)]
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(ctx,)) as pool:
+        masks = list(pool.map(_evaluate_shard, shards, [rule_names] * len(shards)))
+    return pd.concat(masks)
+
+
+def _count_shard(shard, cols, offset):
+    import Dataset
+    return Dataset.Dataset.from_frame(shard.reset_index(drop=True), cols).combo_result_counts(offset)
+
+
+def combo_result_counts(df, cols, workers):
+    # Dataset.combo_result_counts over the whole frame, each shard counted in its own process then merged
+    import Dataset
+    workers = worker_count(workers)
+    bounds = shard_bounds(len(df), workers)
+    if workers <= 1 or len(bounds) < 2:
+        return Dataset.Dataset.from_frame(df, cols).combo_result_counts()
+    shards = [df.iloc[start:stop] for start, stop in bounds]
+    with ProcessPoolExecutor(workers) as pool:
+        parts = list(pool.map(_count_shard, shards, [cols] * len(shards), [start for start, _ in bounds]))
+    return Dataset.Dataset.merge_combo_result_counts(parts)
@@ -0,0 +1,95 @@
+import os
+import shutil
+import pandas as pd
+import schema
+
+
+# partitioned parquet copy of the cleaned data, written alongside msm_data.csv
+# files are laid out as <dir>/Month=2025-08/Island=M Cold/part-0-0.parquet so reading one island or date range only
+# opens the matching files. pyarrow is optional, only needed if parquet export or reading is used
+
+MONTH_COL = "Month"
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("pyarrow is required for parquet export/reading, install it with: pip install pyarrow")
+    return pyarrow
+
+
+def write_partitioned(df, cols, output_dir, part=0):
+    # cols is the Schema of df, the frame should be typed (see schema.to_typed) so dtypes carry over
+    # part numbers the files when a frame is written in chunks, part 0 starts the export over
+    pa = require_pyarrow()
+    if cols.date is None or cols.island is None:
+        raise ValueError("parquet export needs the date and island columns to partition by")
+
+    df = df.copy()
+    # formatted once per distinct date rather than once per row
+    codes, dates = pd.factorize(df[cols.date])
+    months = pd.Series([date.strftime("%Y-%m") for date in dates] + ["unknown"], dtype=object)
+    df[MONTH_COL] = months.to_numpy()[codes]
+    df[cols.island] = df[cols.island].astype(str).where(df[cols.island].notna(), "unknown")
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    # rewritten from scratch so partitions that no longer have rows don't linger
+    if part == 0 and os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    pa.dataset.write_dataset(
+        table, output_dir, format="parquet",
+        partitioning=pa.dataset.partitioning(pa.schema([(MONTH_COL, pa.string()), (cols.island, pa.string())]), flavor="hive"),
+        basename_template=f"part-{part}-{{i}}.parquet", existing_data_behavior="overwrite_or_ignore",
+    )
+    return directory_size(output_dir)
+
+
+def directory_size(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def read_partitioned(input_dir, columns=None, islands=None, start=None, end=None):
+    # reads the partitioned export, only the requested columns and only files/row groups that can match
+    # islands is a list of island names, start/end are inclusive dates (anything pd.Timestamp accepts)
+    pa = require_pyarrow()
+    ds = pa.dataset
+    partitioning = ds.partitioning(flavor="hive", dictionaries="infer")
+    dataset = ds.dataset(input_dir, format="parquet", partitioning=partitioning)
+    cols = schema.Schema(dataset.schema.names)
+
+    # partition filters prune whole directories, the date filter is pushed down to the row groups
+    conditions = []
+    if islands is not None:
+        conditions.append(ds.field(cols.island).isin(list(islands)))
+    if start is not None:
+        start = pd.Timestamp(start)
+        conditions.append(ds.field(MONTH_COL) >= start.strftime("%Y-%m"))
+        conditions.append(ds.field(cols.date) >= pa.scalar(start, type=dataset.schema.field(cols.date).type))
+    if end is not None:
+        end = pd.Timestamp(end)
+        conditions.append(ds.field(MONTH_COL) <= end.strftime("%Y-%m"))
+        conditions.append(ds.field(cols.date) <= pa.scalar(end, type=dataset.schema.field(cols.date).type))
+    condition = None
+    for current in conditions:
+        condition = current if condition is None else condition & current
+
+    if columns is None:
+        # original column order from the pandas metadata, partition columns are otherwise moved to the end
+        metadata = dataset.schema.pandas_metadata or {}
+        written = [col["name"] for col in metadata.get("columns", []) if col["name"] in dataset.schema.names]
+        columns = written or dataset.schema.names
+        columns = [name for name in columns if name != MONTH_COL]
+    return from_arrow(dataset.to_table(columns=list(columns), filter=condition))
+
+
+def from_arrow(table):
+    # (frame, Schema) of an arrow table of cleaned data, columns keep the dtypes they were written with
+    df = table.to_pandas()
+    cols = schema.Schema(df.columns)
+    # partition columns come back as dictionaries
+    if cols.island in df.columns:
+        df[cols.island] = df[cols.island].astype("category")
+    return df.reset_index(drop=True), cols
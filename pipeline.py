@@ -0,0 +1,663 @@
+import hashlib
+import os
+import pickle
+from io import StringIO
+from types import SimpleNamespace
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter, Retry
+import Dataset
+import rules
+import schema
+import parquet_store
+import parallel
+import profiling
+import resample
+from availability import AvailabilityIndex
+from breeding import BreedingIndex
+from event_calendar import EventCalendar
+from fetch import SheetFetcher, LocalSheetAdapter, sheet_url
+from identity import RARITIES, shared_identity
+from names import NameIndex
+from outcome_matrix import OutcomeMatrix
+from snapshot import AggregateSnapshot
+from state_store import StateStore, row_hashes, options_fingerprint, file_digest
+
+
+# the cleaning pipeline behind main.py, split into stages that can be called on their own:
+#   fetch -> flatten -> coerce -> validate -> post_process -> export -> analyse
+# each stage runs the ones before it if they haven't run yet. options are the UPPERCASE settings from main.py as a
+# dict (see main.options). flatten, coerce and validate results are memoised on disk keyed by their input and the
+# options they read, so changing a post-processing option only reruns the last stages
+
+STAGES = ["fetch", "flatten", "coerce", "validate", "post_process", "export", "analyse"]
+
+# live master sheet and the list of monsters
+SHEET_ID = "15kDI5lQL7szwh4YbjeZ6c4xRcLNpiMkXwLwfQzqGhCQ"
+GID = "0"
+VALIDATION_SHEET_ID = "1jn0Pt8SH0ve0WiH8RZlL-nyQODSriUCOJQlN6yLc9_E"
+VALIDATION_GID = "1001758888"
+
+AVAILABILITIES_CSV = './other data/availabilities.csv'
+MONSTER_ELEMENTS_CSV = './other data/msm_monster_elements.csv'
+SPECIALS_CSV = './other data/specials.csv'
+ISLANDS_CSV = './other data/msm_islands_elements_monsters.csv'
+GROUPS_CSV = './other data/groups.csv'
+FLATTENED_CSV = './intermediary logs/msm_data_flattened.csv'
+SHEET_EXPORT_CSV = './intermediary logs/msm_data_export.csv'  # streaming mode's download when there's no sheet cache
+CLEANED_CSV = 'msm_data.csv'
+GROUPED_CSV = 'grouped_results.csv'
+
+# reference data the validation rules read, a change to any of them invalidates the incremental state
+REFERENCE_FILES = [AVAILABILITIES_CSV, MONSTER_ELEMENTS_CSV, SPECIALS_CSV, ISLANDS_CSV]
+
+# list of possible island names
+ISLAND_NAMES = ["Plant", "Cold", "Air", "Water", "Earth", "Shugabush", "Ethereal", "Haven", "Oasis", "Mythical", "Light", "Psychic", "Faerie", "Bone", "Sanctum", "Shanty", "M Plant", "M Cold", "M Air", "M Water", "M Earth", "M Light", "M Psychic", "M Faerie", "M Bone"]
+
+# options that change how rows are cleaned, by prefix. fetching and output paths don't invalidate anything
+CLEANING_OPTIONS = ('ASSUME_', 'TITLE_CASE_', 'REPAIR_', 'VALIDATE_', 'REMOVE_', 'RARE_', 'USE_')
+COERCE_OPTIONS = ('ASSUME_', 'TITLE_CASE_', 'REPAIR_')
+# the time rule only runs if the time since reset column is kept
+VALIDATE_OPTIONS = ('VALIDATE_', 'REMOVE_TIME_SINCE_RESET')
+
+
+class SheetFormatError(ValueError):
+    # the master sheet's layout changed and can't be flattened
+    pass
+
+
+def text_digest(*texts):
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class StageCache:
+    # pickled stage outputs, one file per stage holding only the latest key, so the cache doesn't grow between runs
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, stage):
+        return os.path.join(self.cache_dir, f"{stage}.pkl")
+
+    def load(self, stage, key):
+        if not self.cache_dir or not os.path.exists(self._path(stage)):
+            return None
+        try:
+            with open(self._path(stage), "rb") as f:
+                stored_key, value = pickle.load(f)
+        except Exception:
+            # unreadable, e.g. written by another pandas version, treated as a miss
+            return None
+        return value if stored_key == key else None
+
+    def save(self, stage, key, value):
+        if not self.cache_dir:
+            return
+        tmp = self._path(stage) + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump((key, value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(stage))
+
+
+class Pipeline:
+
+    def __init__(self, options):
+        self.options = SimpleNamespace(**options)
+        self.cache = StageCache(self.options.STAGE_CACHE_DIR)
+        self.keys = {}  # memo key of each stage's output
+        self.fetcher = self.url = None  # kept between fetches so watch mode reuses the session and its connections
+        self.sheet_text = self.validation_text = None
+        self.sheet_file = None  # streaming mode keeps the export on disk instead of in sheet_text
+        self.df = self.schema = None
+        self.typed = self.coerced = None
+        self.violation_mask = self.to_drop = None
+        self.cleaned = self.name_map = None
+        self.store = None  # state store, incremental mode only
+        self.totals = None  # row and violation counts, set by streaming mode which doesn't keep the frames
+        self._rule_context = None
+        self._name_indexes = {}
+        self.exported = False
+        self.dataset = None  # Dataset of the cleaned rows, set by analyse
+        # spans of every stage and rule when PROFILE_FILE is set, see profiling.py
+        self.tracer = profiling.NULL_TRACER
+        if self.options.PROFILE_FILE:
+            self.tracer = profiling.Tracer(self.options.PROFILE_HOOK, os.path.dirname(self.options.PROFILE_FILE) or ".")
+
+    def _options(self, prefixes):
+        return {name: value for name, value in vars(self.options).items() if name.startswith(prefixes)}
+
+    def _memoised(self, stage, key, compute):
+        value = self.cache.load(stage, key)
+        if value is None:
+            value = compute()
+            self.cache.save(stage, key, value)
+        else:
+            print(f"Reused {stage} output from the stage cache")
+        self.keys[stage] = key
+        return value
+
+    # fetch ============================================================================================================
+
+    def fetch(self):
+        # the master sheet and the list of monsters as csv text, both at once. in streaming mode the master sheet is
+        # streamed to a file (sheet_file) instead and never read into memory
+        if self.fetcher is None:
+            self.fetcher = self._fetcher()
+        url = sheet_url(SHEET_ID, GID)
+        url_val = sheet_url(VALIDATION_SHEET_ID, VALIDATION_GID)
+        print("Fetching breeding data from:", url)
+        print("Fetching validation data from:", url_val)
+        files = {url: SHEET_EXPORT_CSV} if self.options.STREAMING else None
+        sheets = self.fetcher.fetch_all([url, url_val], files)
+        self.url = url
+        self.validation_text = sheets[url_val]
+        if files:
+            self.sheet_file, sheet_digest = sheets[url]
+            self.keys["fetch"] = text_digest(sheet_digest, self.validation_text)
+        else:
+            self.sheet_text = sheets[url]
+            self.keys["fetch"] = text_digest(self.sheet_text, self.validation_text)
+        return self.sheet_text, self.validation_text
+
+    def _fetcher(self):
+        o = self.options
+        # session setup with retry logic as google sheets errors on request sometimes
+        session = requests.Session()
+        retries = Retry(
+            total=5,
+            backoff_factor=1,
+            status_forcelist=[500, 502, 503, 504],
+        )
+        session.mount("https://", HTTPAdapter(max_retries=retries))
+        if o.OFFLINE_SHEETS_DIR:
+            # serves the sheets from local files instead of google, the rest of the pipeline is unchanged
+            session.mount("https://docs.google.com/", LocalSheetAdapter(o.OFFLINE_SHEETS_DIR))
+        return SheetFetcher(session, cache_dir=o.SHEET_CACHE_DIR, ttl=o.SHEET_CACHE_TTL)
+
+    def _validation_lists(self):
+        df_val = pd.read_csv(StringIO(self.validation_text), usecols=[1, 2], header=0)
+        parents = df_val['Monsters that breed'].dropna().unique().tolist()
+        results = df_val['Monsters that are bred'].dropna().unique().tolist()
+        return parents, results
+
+    # flatten ==========================================================================================================
+
+    def flatten(self):
+        if "fetch" not in self.keys:
+            self.fetch()
+        if self.sheet_text is None:
+            # fetched for streaming mode but only flattened
+            with open(self.sheet_file, encoding="utf-8", newline="") as f:
+                self.sheet_text = f.read()
+
+        def compute():
+            try:
+                # flattening nested columns while parsing, see schema.py
+                df = schema.read_sheet(self.sheet_text)
+            except ValueError as e:
+                raise SheetFormatError(str(e)) from e  # format has changed
+            parents, results = self._validation_lists()
+            # saving the flattened csv for reference (to test sanitization and validation steps)
+            df.to_csv(FLATTENED_CSV, index=False)
+            return df, parents, results
+
+        self.df, self.parent_monsters, self.result_monsters = self._memoised("flatten", self.keys["fetch"], compute)
+        self.schema = schema.Schema(self.df.columns)
+        print("Breeding data fetched")
+        print("Validation data fetched")
+        return self.df
+
+    # coerce ===========================================================================================================
+
+    def _coerce(self, df):
+        # storing row coercions for summary at end
+        o = self.options
+        coerced = {}
+        cols = self.schema
+
+        # cleaning up island names if required
+        if o.TITLE_CASE_ISLAND_NAME:
+            coerced['title_case_island_name'] = schema.count_changed(df[cols.island], str.title)
+            df[cols.island] = schema.map_categories(df[cols.island], str.title)
+
+        # fixing near-miss names against the validation lists if required, once per distinct name (see names.py)
+        if o.REPAIR_NAMES:
+            for column, names in ((cols.island, 'islands'), (cols.parent1, 'parents'), (cols.parent2, 'parents'), (cols.result, 'results')):
+                repairs = self._name_index(names).repairs(df[column].cat.categories)
+                if repairs:
+                    counts = df[column].value_counts()
+                    for old, new in repairs.items():
+                        key = f"repair_names: {old!r} -> {new!r}"
+                        coerced[key] = coerced.get(key, 0) + int(counts[old])
+                    df[column] = schema.map_categories(df[column], lambda name: repairs.get(name, name))
+
+        # coercing blank torch entries to zero if required
+        if o.ASSUME_ZERO_TORCHES:
+            coerced['assume_zero_torches'] = df[cols.torches].isna().sum()
+            df[cols.torches] = schema.fill_blanks(df[cols.torches], '0')
+
+        # coercing blank titan skin entries to false if required
+        if o.ASSUME_NO_TITAN_SKIN:
+            coerced['assume_no_titan_skin'] = df[cols.skin].isna().sum()
+            df[cols.skin] = schema.fill_blanks(df[cols.skin], 'False')
+
+        # every column is converted to its typed dtype once, anything that can't be parsed is left blank for validation
+        return schema.to_typed(df, cols), coerced
+
+    def _name_index(self, names):
+        # NameIndex of the islands, parents or results list, built on first use
+        if names not in self._name_indexes:
+            known = {'islands': ISLAND_NAMES, 'parents': self.parent_monsters, 'results': self.result_monsters}[names]
+            self._name_indexes[names] = NameIndex(known, self.options.REPAIR_MAX_DISTANCE)
+        return self._name_indexes[names]
+
+    def coerce(self):
+        if self.df is None:
+            self.flatten()
+        key = options_fingerprint(self.keys["flatten"], self._options(COERCE_OPTIONS), ISLAND_NAMES)
+        self.typed, self.coerced = self._memoised("coerce", key, lambda: self._coerce(self.df.copy()))
+        return self.typed
+
+    # validate =========================================================================================================
+
+    def enabled_rules(self):
+        # rules run in bit order, VALIDATE_* options pick which ones are enabled
+        o = self.options
+        rule_switches = {
+            'date': o.VALIDATE_MSM_DATE,
+            'daynight': o.VALIDATE_DAY_OR_NIGHT,
+            'time': not o.REMOVE_TIME_SINCE_RESET,  # time since reset is only validated if the column is kept
+            'island': o.VALIDATE_ISLAND_NAME,
+            'skin': o.VALIDATE_TITAN_SKIN,
+            'torches': o.VALIDATE_TORCH_COUNT,
+            'parents': o.VALIDATE_PARENTS_EXIST,
+            'levels': o.VALIDATE_PARENT_LEVELS,
+            'result': o.VALIDATE_RESULTS_EXIST,
+            'availability': o.VALIDATE_AVAILABILITY,  # availability isn't a complete list! off by default
+            'breed': o.VALIDATE_BREED_POSSIBLE,
+        }
+        return [name for name in rules.RULES if rule_switches.get(name)]
+
+    def rule_context(self):
+        if self._rule_context is None:
+            # opening availabilities.csv as a sorted interval index, contains an incomplete list of breeding availabilities (WIP)
+            availabilities = AvailabilityIndex.from_csv(AVAILABILITIES_CSV)
+            print("Loaded availabilities for", len(availabilities), "monsters from", AVAILABILITIES_CSV)
+            # the integer identity table Dataset groups with, seeded with the scraped species, plus the sheet's lists
+            identity = shared_identity()
+            for name in self.parent_monsters + self.result_monsters:
+                identity.add(name)
+            self._rule_context = {
+                'island_names': ISLAND_NAMES,
+                'parent_monsters': self.parent_monsters,
+                'result_monsters': self.result_monsters,
+                'identity': identity,
+                'availabilities': availabilities,
+                'schema': self.schema,
+            }
+            if self.options.VALIDATE_BREED_POSSIBLE:
+                # element bitmask lookup table of every result each pair of parents can breed
+                self._rule_context['breeding'] = BreedingIndex.from_csv(MONSTER_ELEMENTS_CSV, SPECIALS_CSV, ISLANDS_CSV)
+        return self._rule_context
+
+    def _validate(self, original):
+        # each check runs on the original then a cleaned version is created at the end with violations removed or coerced
+        # every enabled rule sets its own bit in one bitmask per row, see rules.py
+        return parallel.evaluate(original, self.enabled_rules(), self.rule_context(), self.options.WORKERS, self.tracer)
+
+    def _drop_violations(self, original, mask, quarantine=True):
+        # violating rows go to the quarantine file with their rule bits rather than being printed
+        for rule, count in rules.rule_counts(mask, self.enabled_rules()).items():
+            if count > 0:
+                print(f"Found {count} violations of rule: {rule}")
+        if quarantine and self.options.QUARANTINE_FILE:
+            quarantined = rules.write_quarantine(schema.for_export(original, self.schema), mask, self.options.QUARANTINE_FILE)
+            print(f"Wrote {quarantined} violating rows to {self.options.QUARANTINE_FILE}")
+        return original.index[mask.to_numpy() != 0]
+
+    def validate(self):
+        if self.typed is None:
+            self.coerce()
+        key = options_fingerprint(
+            self.keys["coerce"], self._options(VALIDATE_OPTIONS), ISLAND_NAMES, file_digest(REFERENCE_FILES),
+        )
+        self.violation_mask = self._memoised("validate", key, lambda: self._validate(self.typed))
+        self.to_drop = self._drop_violations(self.typed, self.violation_mask)
+        return self.violation_mask
+
+    # post-process =====================================================================================================
+
+    def _post_process(self, cleaned, coerced, name_map, quiet=False):
+        o = self.options
+        cols = self.schema
+
+        # treat rare parents as common?
+        if o.RARE_PARENTS_AS_COMMON:
+            # rarity read from the shared identity table, per category
+            identity, rare = shared_identity(), RARITIES.index('rare')
+            coerced['rare_parents_as_common'] = int((identity.rarity_codes(cleaned[cols.parent1]) == rare).sum() + (identity.rarity_codes(cleaned[cols.parent2]) == rare).sum())
+            def as_common(name):
+                return identity.common_name(name) if identity.rarity_of(name) == rare else name
+            cleaned[cols.parent1] = schema.map_categories(cleaned[cols.parent1], as_common)
+            cleaned[cols.parent2] = schema.map_categories(cleaned[cols.parent2], as_common)
+            if not quiet:
+                print(f"[x] Converted {coerced['rare_parents_as_common']} rare parents to common\n")
+
+        # drop time since reset?
+        if o.REMOVE_TIME_SINCE_RESET:
+            cleaned = cleaned.drop(columns=[cols.time])
+
+        # replace source names with pseudonyms?
+        # name_map is extended in place so pseudonyms stay the same for names already seen on a previous run
+        if o.USE_SOURCE_PSEUDONYMS:
+            unique_names = cleaned[cols.source].dropna().unique().tolist()
+            for name in unique_names:
+                if name not in name_map:
+                    name_map[name] = f"Player{len(name_map)+1}"
+            cleaned[cols.source] = schema.map_categories(cleaned[cols.source], lambda name: name_map.get(name, name))
+            if not quiet:
+                print(f"[x] Replaced {len(unique_names)} unique source names with pseudonyms\n")
+
+        return cleaned
+
+    def post_process(self):
+        if self.violation_mask is None:
+            self.validate()
+        # making the clean data set
+        cleaned = self.typed.drop(index=self.to_drop).reset_index(drop=True)
+        self.name_map = {}
+        self.cleaned = self._post_process(cleaned, self.coerced, self.name_map)
+        return self.cleaned
+
+    # incremental ======================================================================================================
+
+    def run_incremental(self):
+        # only rows that are new or changed since the last run are coerced and validated, the rest come from the store
+        # stands in for coerce, validate and post_process
+        if self.df is None:
+            self.flatten()
+        self.store = StateStore(self.options.STATE_DB)
+        fingerprint = options_fingerprint(
+            self._options(CLEANING_OPTIONS), list(self.df.columns), ISLAND_NAMES, self.parent_monsters,
+            self.result_monsters, file_digest(REFERENCE_FILES),
+        )
+        if self.store.fingerprint() != fingerprint:
+            print("Options, columns or validation lists changed since the last run, rebuilding the state store")
+            self.store.reset(fingerprint)
+
+        self.hashes = row_hashes(self.df)
+        self.delta = self.store.changed_rows(self.hashes)
+        self.previous_row_count = self.store.row_count()
+        print(f"Incremental mode: {len(self.delta)} new or changed rows out of {len(self.df)}")
+
+        self.typed, self.coerced = self._coerce(self.df.loc[self.delta].copy())
+        original = self.typed
+        self.violation_mask = self._validate(original)
+        # the quarantine is rebuilt below from every stored verdict, not just those of the changed rows
+        self.to_drop = self._drop_violations(original, self.violation_mask, quarantine=False)
+
+        cleaned = original.drop(index=self.to_drop)
+        self.name_map = self.store.pseudonyms()
+        self.cleaned = self._post_process(cleaned, self.coerced, self.name_map)
+
+        violations = [rules.rules_from_mask(value) for value in self.violation_mask]
+        self.store.update_rows(original.index, self.hashes[original.index], violations, schema.for_export(self.cleaned, self.schema))
+        self.store.truncate(len(self.hashes))
+        self.store.set_pseudonyms(self.name_map)
+        self.store.set_columns(self.cleaned.columns)
+        self.store.commit()
+        if self.options.QUARANTINE_FILE:
+            self._rebuild_quarantine()
+        return self.cleaned
+
+    def _rebuild_quarantine(self):
+        # every row the store holds a failing verdict for, changed or not, re-coerced from the sheet (coercion is
+        # deterministic so they come out as they were when validated) with the stored rule bits
+        failing = self.store.failing_rows()
+        positions = list(failing)
+        typed, _ = self._coerce(self.df.loc[positions].copy())
+        mask = pd.Series([rules.mask_from_rules(names) for names in failing.values()], index=typed.index, dtype="uint32")
+        quarantined = rules.write_quarantine(schema.for_export(typed, self.schema), mask, self.options.QUARANTINE_FILE)
+        print(f"Wrote {quarantined} violating rows to {self.options.QUARANTINE_FILE}")
+
+    # streaming ========================================================================================================
+
+    def run_streaming(self):
+        # bounded memory stand-in for flatten to analyse: the export is read STREAM_CHUNK_ROWS rows at a time and each
+        # chunk is coerced, validated, post-processed and appended to every output. only counts, the pseudonym map and
+        # the grouped results' partial aggregate (one row per distinct combo and result) outlive a chunk
+        o = self.options
+        if "fetch" not in self.keys:
+            self.fetch()
+        # the chunks are read straight from the file fetch streamed the export to
+        source = self.sheet_file if self.sheet_text is None else StringIO(self.sheet_text)
+        self.parent_monsters, self.result_monsters = self._validation_lists()
+
+        enabled = self.enabled_rules()
+        self.coerced, self.name_map = {}, {}
+        self.totals = {'rows': 0, 'dropped': 0, 'cleaned': 0, 'violations': dict.fromkeys(enabled, 0)}
+        parts = []
+        calendar = breeding = None
+        if o.EXPORT_CANDIDATE_OUTCOMES:
+            calendar = EventCalendar.from_csv(AVAILABILITIES_CSV, o.BONANZAS_FILE, GROUPS_CSV)
+            breeding = BreedingIndex.from_csv(MONSTER_ELEMENTS_CSV, SPECIALS_CSV, ISLANDS_CSV)
+        write_parquet = o.EXPORT_PARQUET
+        if write_parquet:
+            try:
+                parquet_store.require_pyarrow()
+            except ImportError as e:
+                print(f"Skipped parquet export: {e}")
+                write_parquet = False
+
+        for number, chunk in enumerate(schema.read_sheet_chunks(source, o.STREAM_CHUNK_ROWS)):
+            first = number == 0
+            mode = "w" if first else "a"
+            if first:
+                self.schema = schema.Schema(chunk.columns)
+            chunk.to_csv(FLATTENED_CSV, mode=mode, header=first, index=False)
+
+            with self.tracer.span("coerce", "chunk", len(chunk)) as span:
+                typed, coerced = self._coerce(chunk)
+                span.rows_out = len(typed)
+            with self.tracer.span("validate", "chunk", len(typed)) as span:
+                mask = self._validate(typed)
+                if o.QUARANTINE_FILE:
+                    if first:
+                        open(o.QUARANTINE_FILE, "w").close()
+                    rules.write_quarantine(schema.for_export(typed, self.schema), mask, o.QUARANTINE_FILE, mode="a")
+                cleaned = typed[mask.to_numpy() == 0].reset_index(drop=True)
+                span.rows_out = len(cleaned)
+            with self.tracer.span("post_process", "chunk", len(cleaned)) as span:
+                # name_map carries over between chunks so a source keeps its pseudonym
+                cleaned = self._post_process(cleaned, coerced, self.name_map, quiet=True)
+                span.rows_out = len(cleaned)
+
+            for name, count in coerced.items():
+                self.coerced[name] = self.coerced.get(name, 0) + count
+            for name, count in rules.rule_counts(mask, enabled).items():
+                self.totals['violations'][name] += count
+            offset, start = self.totals['cleaned'], self.totals['rows']
+            self.totals['rows'] += len(typed)
+            self.totals['dropped'] += int((mask.to_numpy() != 0).sum())
+            self.totals['cleaned'] += len(cleaned)
+
+            with self.tracer.span("export", "chunk", len(cleaned)) as span:
+                schema.for_export(cleaned, self.schema).to_csv(CLEANED_CSV, mode=mode, header=first, index=False)
+                if write_parquet:
+                    parquet_store.write_partitioned(cleaned, self.schema, o.PARQUET_DIR, part=number)
+                span.rows_out = len(cleaned)
+            with self.tracer.span("analyse", "chunk", len(cleaned)):
+                dataset = Dataset.Dataset.from_frame(cleaned, self.schema)
+                parts.append(dataset.combo_result_counts(offset))
+                if len(parts) >= 8:
+                    parts = [Dataset.Dataset.merge_combo_result_counts(parts)]
+                if calendar is not None:
+                    dataset.export_candidate_outcomes(calendar, breeding, append=not first)
+            print(f"Streamed rows {start + 1}-{self.totals['rows']}")
+
+        self.summary()
+        print(f"Exported cleaned data to {CLEANED_CSV}")
+        if write_parquet:
+            print(f"Exported cleaned data to {o.PARQUET_DIR} ({parquet_store.directory_size(o.PARQUET_DIR) / 1024:.0f} KiB)")
+        counts = Dataset.Dataset.merge_combo_result_counts(parts)
+        Dataset.Dataset.grouped_results(counts).to_csv(GROUPED_CSV, index=False)
+        print(f"Exported grouped results to {GROUPED_CSV}")
+        if o.GROUPED_SNAPSHOT_FILE:
+            self.save_snapshot(AggregateSnapshot.from_counts(counts, self.totals['cleaned']))
+        if o.OUTCOME_MATRIX_DIR or o.RATE_QUANTILES_FILE:
+            self.save_outcome_matrix(OutcomeMatrix.from_counts(counts))
+        self.exported = True
+
+    # summary ==========================================================================================================
+
+    def summary(self):
+        o = self.options
+        print("\nSummary ================================")
+
+        if o.USE_SOURCE_PSEUDONYMS:
+            print(f" [✓] Replaced {len(self.name_map)} unique source names with pseudonyms")
+
+        if o.REMOVE_TIME_SINCE_RESET:
+            print(f" [✓] Dropped column: {self.schema.time}")
+
+        total_coercions = 0
+        for rule, count in self.coerced.items():
+            if count > 0:
+                total_coercions += count
+                print(f" [✓] Coerced {count} entries for: {rule}")
+
+        totals = self.totals or {
+            'rows': len(self.typed),
+            'dropped': len(self.to_drop),
+            'cleaned': len(self.cleaned),
+            'violations': rules.rule_counts(self.violation_mask, self.enabled_rules()),
+        }
+        total_violations = 0
+        for rule, count in totals['violations'].items():
+            if count > 0:
+                total_violations += count
+                print(f" [✓] Removed {count} violations of rule: {rule}")
+
+        print("\n Original row count:", totals['rows'])
+        print(f" Unique rows dropped: {totals['dropped']}")
+        print(" Cleaned row count:", totals['cleaned'])
+        if o.INCREMENTAL:
+            print(f" Rows reused from the state store: {len(self.hashes) - len(self.delta)}")
+
+        print("========================================")
+
+    # export ===========================================================================================================
+
+    def export(self):
+        o = self.options
+        if self.cleaned is None:
+            self.run_incremental() if o.INCREMENTAL else self.post_process()
+            self.summary()
+
+        if self.store is not None:
+            # rows only appended since the last run are appended to the existing export, anything else rewrites it from the store
+            appended_only = len(self.hashes) >= self.previous_row_count and (len(self.delta) == 0 or min(self.delta) >= self.previous_row_count)
+            if appended_only and self.store.export_matches(CLEANED_CSV):
+                schema.for_export(self.cleaned, self.schema).to_csv(CLEANED_CSV, mode='a', header=False, index=False)
+                print(f"Appended {len(self.cleaned)} cleaned rows to {CLEANED_CSV}")
+            else:
+                self.store.cleaned_frame().to_csv(CLEANED_CSV, index=False)
+                print(f"Exported cleaned data to {CLEANED_CSV}")
+            self.store.record_export(CLEANED_CSV)
+            self.store.close()
+        else:
+            schema.for_export(self.cleaned, self.schema).to_csv(CLEANED_CSV, index=False)
+            print(f"Exported cleaned data to {CLEANED_CSV}")
+
+        # parquet copy partitioned by month and island, typed so it can be read back without parsing
+        if o.EXPORT_PARQUET:
+            try:
+                parquet_store.require_pyarrow()
+                export_df = self.cleaned if self.store is None else schema.read_cleaned(CLEANED_CSV)[0]
+                parquet_size = parquet_store.write_partitioned(export_df, self.schema, o.PARQUET_DIR)
+                print(f"Exported cleaned data to {o.PARQUET_DIR} ({parquet_size / 1024:.0f} KiB)")
+            except ImportError as e:
+                print(f"Skipped parquet export: {e}")
+        self.exported = True
+
+    # analyse ==========================================================================================================
+
+    def save_snapshot(self, snapshot):
+        snapshot.save(self.options.GROUPED_SNAPSHOT_FILE)
+        print(f"Saved grouped results snapshot to {self.options.GROUPED_SNAPSHOT_FILE} ({len(snapshot)} combo results)")
+
+    def save_outcome_matrix(self, matrix):
+        # the sparse outcome matrix and/or the breed rates' resampled quantiles computed from it
+        o = self.options
+        if o.OUTCOME_MATRIX_DIR:
+            matrix.save(o.OUTCOME_MATRIX_DIR)
+            print(f"Exported outcome matrix to {o.OUTCOME_MATRIX_DIR} ({matrix.shape[0]} combos x {matrix.shape[1]} results)")
+        if o.RATE_QUANTILES_FILE:
+            rates = resample.rate_quantiles(matrix, o.RESAMPLE_METHOD, o.RESAMPLE_SAMPLES, seed=o.RESAMPLE_SEED, workers=o.WORKERS)
+            rates.to_csv(o.RATE_QUANTILES_FILE, index=False)
+            print(f"Exported {o.RESAMPLE_METHOD} rate quantiles of {len(rates)} combo results to {o.RATE_QUANTILES_FILE}")
+
+    def analyse(self):
+        if not self.exported:
+            self.export()
+        # loading the dataset class for analysis, the cleaned frame is handed over as it is rather than reread from the
+        # csv. incremental mode only holds the changed rows so reads the csv
+        dataset = self.dataset = Dataset.Dataset(self.cleaned if self.store is None and self.cleaned is not None else CLEANED_CSV)
+        dataset.export_results_grouped_by_combo(workers=self.options.WORKERS)
+        if self.options.GROUPED_SNAPSHOT_FILE:
+            self.save_snapshot(AggregateSnapshot.from_dataset(dataset))
+        if self.options.OUTCOME_MATRIX_DIR or self.options.RATE_QUANTILES_FILE:
+            self.save_outcome_matrix(OutcomeMatrix.from_dataset(dataset))
+        if self.options.EXPORT_CANDIDATE_OUTCOMES:
+            calendar = EventCalendar.from_csv(AVAILABILITIES_CSV, self.options.BONANZAS_FILE, GROUPS_CSV)
+            breeding = (self._rule_context or {}).get('breeding') or BreedingIndex.from_csv(MONSTER_ELEMENTS_CSV, SPECIALS_CSV, ISLANDS_CSV)
+            dataset.export_candidate_outcomes(calendar, breeding)
+        return dataset
+
+    def _rows_out(self, step):
+        # rows a step hands on to the next, for the profiling spans
+        if step == "flatten":
+            return len(self.df)
+        if step == "coerce":
+            return len(self.typed)
+        if step == "validate":
+            return len(self.typed) - len(self.to_drop)
+        if step == "streaming":
+            return self.totals['cleaned']
+        if step != "fetch" and self.cleaned is not None:
+            return len(self.cleaned)
+        return None
+
+    def run(self, until="analyse"):
+        # runs every stage up to and including until, each in its own profiling span
+        if until not in STAGES:
+            raise ValueError(f"unknown stage {until!r}, expected one of {', '.join(STAGES)}")
+        stop = STAGES.index(until)
+        steps = STAGES[:stop + 1]
+        if stop >= STAGES.index("coerce") and self.options.STREAMING:
+            # streaming mode runs every stage chunk by chunk, so it always runs to the end
+            steps = ["fetch", "streaming"]
+        elif stop >= STAGES.index("coerce") and self.options.INCREMENTAL:
+            # incremental mode coerces, validates and post-processes only the changed rows in one step
+            steps = ["fetch", "flatten", "incremental"] + STAGES[STAGES.index("export"):stop + 1]
+        methods = {"streaming": self.run_streaming, "incremental": self.run_incremental}
+        rows = None
+        try:
+            for step in steps:
+                if step == "fetch" and "fetch" in self.keys:
+                    continue  # already fetched, e.g. by watch mode checking whether the sheet changed
+                with self.tracer.span(step, rows_in=rows) as span:
+                    (methods[step] if step in methods else getattr(self, step))()
+                    rows = span.rows_out = self._rows_out(step)
+                if step in ("post_process", "incremental"):
+                    self.summary()
+        finally:
+            if self.tracer.enabled:
+                self.tracer.close()
+                self.tracer.write(self.options.PROFILE_FILE, self.options.PROFILE_FORMAT)
+        return self
@@ -0,0 +1,175 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+# per-stage instrumentation: wall time, cpu time, peak resident memory and rows in/out of every pipeline stage and
+# validation rule, written as json records or a chrome trace (chrome://tracing or ui.perfetto.dev)
+# switched off the pipeline uses NULL_TRACER, whose spans are one shared object that does nothing
+
+HOOKS = ("cprofile", "tracemalloc")
+FORMATS = ("json", "chrome")
+
+
+def current_rss():
+    # resident memory in bytes, from /proc on linux or psutil elsewhere if it is installed, None if neither works
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+
+class NullSpan:
+    rows_in = rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullTracer:
+    enabled = False
+    _span = NullSpan()
+
+    def span(self, name, category="stage", rows_in=None):
+        return self._span
+
+    def close(self):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+class Span:
+
+    def __init__(self, tracer, name, category, rows_in):
+        self.tracer, self.name, self.category = tracer, name, category
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.extra = {}
+
+    def __enter__(self):
+        tracer = self.tracer
+        self.depth = len(tracer.open)
+        self.rss_start = self.peak_rss = current_rss()
+        self.profiler = None
+        if tracer.hook and self.category == "stage" and not tracer.hooked:
+            # hooks only wrap the outermost stage spans, cProfile can't nest and tracemalloc would count twice
+            tracer.hooked = self
+            if tracer.hook == "cprofile":
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+            else:
+                tracemalloc.start()
+        tracer.open.append(self)
+        self.cpu_start = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        tracer = self.tracer
+        tracer.open.remove(self)
+        rss = current_rss()
+        if rss is not None:
+            self.peak_rss = max(self.peak_rss, rss)
+        if tracer.hooked is self:
+            tracer.hooked = None
+            self._finish_hook()
+        tracer.records.append({
+            "name": self.name,
+            "category": self.category,
+            "depth": self.depth,
+            "start_s": self.start - tracer.started,
+            "wall_s": wall,
+            "cpu_s": cpu,
+            "rss_start_mib": self.rss_start / 2**20 if self.rss_start is not None else None,
+            "peak_rss_mib": self.peak_rss / 2**20 if self.peak_rss is not None else None,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            **self.extra,
+        })
+        return False
+
+    def _finish_hook(self):
+        tracer = self.tracer
+        base = os.path.join(tracer.output_dir, f"{len(tracer.records):02d}_{self.name}")
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(base + ".prof")
+            self.extra["profile"] = base + ".prof"
+        else:
+            snapshot = tracemalloc.take_snapshot()
+            self.extra["tracemalloc_peak_mib"] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            with open(base + ".tracemalloc.txt", "w") as f:
+                for stat in snapshot.statistics("lineno")[:25]:
+                    f.write(f"{stat}\n")
+            self.extra["profile"] = base + ".tracemalloc.txt"
+
+
+class Tracer:
+    # hook is None, "cprofile" or "tracemalloc", run around each top level stage with their output written to
+    # output_dir. resident memory is sampled every interval seconds on a background thread for the spans' peaks
+    enabled = True
+
+    def __init__(self, hook=None, output_dir=".", interval=0.005):
+        if hook is not None and hook not in HOOKS:
+            raise ValueError(f"unknown profiling hook {hook!r}, expected one of {', '.join(HOOKS)}")
+        self.hook, self.output_dir, self.interval = hook, output_dir, interval
+        self.records, self.open = [], []
+        self.hooked = None
+        self.started = time.perf_counter()
+        self._done = threading.Event()
+        self._sampler = None
+        if current_rss() is not None:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            rss = current_rss()
+            for span in list(self.open):
+                span.peak_rss = max(span.peak_rss, rss)
+
+    def span(self, name, category="stage", rows_in=None):
+        # with tracer.span("coerce", rows_in=len(df)) as span: ... span.rows_out = len(typed)
+        return Span(self, name, category, rows_in)
+
+    def close(self):
+        self._done.set()
+        if self._sampler is not None:
+            self._sampler.join()
+
+    def chrome_trace(self):
+        # complete ("X") events in microseconds, the numbers show up under args when a span is clicked
+        pid = os.getpid()
+        events = []
+        for record in sorted(self.records, key=lambda r: r["start_s"]):
+            args = {k: v for k, v in record.items() if k not in ("name", "category", "start_s", "wall_s", "depth") and v is not None}
+            events.append({
+                "name": record["name"], "cat": record["category"], "ph": "X", "pid": pid, "tid": 0,
+                "ts": record["start_s"] * 1e6, "dur": record["wall_s"] * 1e6, "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, output_file, output_format="json"):
+        if output_format not in FORMATS:
+            raise ValueError(f"unknown profile format {output_format!r}, expected one of {', '.join(FORMATS)}")
+        report = self.chrome_trace() if output_format == "chrome" else sorted(self.records, key=lambda r: r["start_s"])
+        with open(output_file, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Wrote {len(self.records)} profiling spans to {output_file}")
@@ -0,0 +1,159 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import parallel
+
+
+# uncertainty of every breed rate from resampling, all combos at once: each chunk of combos draws its samples as one
+# (samples x outcomes) array instead of looping over combos. works on an OutcomeMatrix (see outcome_matrix.py)
+#
+#   bootstrap              the combo's breeds redrawn with replacement, a multinomial with the observed rates
+#   dirichlet              rates drawn from the Dirichlet(counts + prior) posterior
+#   dirichlet-multinomial  a new batch of as many breeds drawn with rates from that posterior
+#
+# the dirichlet methods put the prior on every seen result plus an "other" bucket pooling the results a combo hasn't
+# given yet, so a combo seen once still gets a real interval. a bootstrap can only redraw what was seen, so the rows of
+# combos with a single seen result always resample to 1 and are marked Degenerate in the output
+#
+# chunks hold at most chunk_entries samples x outcomes values to bound memory, and each draws from its own stream of
+# seed so the quantiles are the same whatever the worker count
+
+METHODS = ("bootstrap", "dirichlet", "dirichlet-multinomial")
+QUANTILES = (0.025, 0.5, 0.975)
+
+
+def quantile_label(q):
+    return f"Rate {q * 100:g}%"
+
+
+def chunk_bounds(indptr, samples, chunk_entries):
+    # [(first row, stop row)] of consecutive combos holding at most chunk_entries // samples outcomes, at least one
+    limit = max(1, chunk_entries // samples)
+    bounds, start, rows = [], 0, len(indptr) - 1
+    while start < rows:
+        stop = int(np.searchsorted(indptr, indptr[start] + limit, side="right")) - 1
+        stop = min(max(stop, start + 1), rows)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def sorted_quantiles(values, quantiles):
+    # (rows x quantiles) of each row of values, numpy's default linear interpolation. sorting the rows in place is
+    # several times faster than np.quantile's partitioning for this shape
+    values.sort(axis=1)
+    position = np.asarray(quantiles, dtype=float) * (values.shape[1] - 1)
+    low = np.floor(position).astype(np.int64)
+    high = np.minimum(low + 1, values.shape[1] - 1)
+    below, above = values[:, low].astype(float), values[:, high].astype(float)
+    return below + (above - below) * (position - low)
+
+
+def _multinomial(rng, totals, rates, row, position, lengths, samples):
+    # (outcomes x samples) multinomial counts of every combo at once as conditional binomials, one vectorised draw per
+    # position within a combo: outcome k gets Binomial(breeds left, its rate / the rate left) and the last one whatever
+    # is left without a draw. rates are per outcome or (outcomes x samples)
+    counts = np.empty((len(row), samples), dtype=np.int64)
+    left = np.repeat(totals[:, None].astype(np.int64), samples, axis=1)
+    rate_left = np.ones((len(totals), samples))
+    rates = np.broadcast_to(rates[:, None] if rates.ndim == 1 else rates, (len(row), samples))
+    last = position == lengths[row] - 1
+    for k in range(int(position.max()) + 1 if len(position) else 0):
+        at = position == k
+        take = np.flatnonzero(at & last)
+        counts[take] = left[row[take]]
+        draw = np.flatnonzero(at & ~last)
+        if len(draw):
+            rows = row[draw]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                p = np.clip(np.nan_to_num(rates[draw] / rate_left[rows], nan=1.0), 0, 1)
+            counts[draw] = rng.binomial(left[rows], p)
+            left[rows] -= counts[draw]
+            rate_left[rows] -= rates[draw]
+    return counts
+
+
+def _dirichlet(rng, counts, prior, starts, row, samples):
+    # (outcomes x samples) normalised gamma draws, per combo
+    gamma = rng.standard_gamma(np.repeat((counts + prior)[:, None], samples, axis=1))
+    return gamma / np.add.reduceat(gamma, starts, axis=0)[row]
+
+
+def with_other(indptr, data):
+    # (indptr, data, mask of the original outcomes) with a 0 count "other" outcome appended to every combo
+    lengths = np.diff(indptr)
+    keep = np.ones(len(data) + len(lengths), dtype=bool)
+    keep[indptr[1:] + np.arange(len(lengths))] = False
+    padded = np.zeros(len(keep), dtype=data.dtype)
+    padded[keep] = data
+    return np.append(0, np.cumsum(lengths + 1)), padded, keep
+
+
+def chunk_quantiles(indptr, data, totals, method, samples, quantiles, prior, seed):
+    # (outcomes x quantiles) array of one chunk's rate quantiles, indptr starting at 0
+    rng = np.random.default_rng(seed)
+    values = np.ones((len(data), len(quantiles)))
+    if method == "bootstrap":
+        # a combo with a single seen result redraws it every time, only the others are drawn
+        drawn = np.repeat(np.diff(indptr) > 1, np.diff(indptr))
+    else:
+        indptr, data, drawn = with_other(indptr, data)
+    if not drawn.any():
+        return values
+    lengths = np.diff(indptr)
+    several = lengths > 1
+    sampled = np.repeat(several, lengths)
+    lengths, data, totals = lengths[several], data[sampled], totals[several]
+    starts = np.cumsum(lengths) - lengths
+    row = np.repeat(np.arange(len(totals)), lengths)
+    position = np.arange(len(data)) - starts[row]
+    if method == "dirichlet":
+        found = sorted_quantiles(_dirichlet(rng, data, prior, starts, row, samples), quantiles)
+    else:
+        # counts are sorted as integers and only their quantiles divided by the total
+        rates = data / totals[row] if method == "bootstrap" else _dirichlet(rng, data, prior, starts, row, samples)
+        counts = _multinomial(rng, totals, rates, row, position, lengths, samples)
+        found = sorted_quantiles(counts, quantiles) / totals[row][:, None]
+    if method == "bootstrap":
+        values[drawn] = found
+    else:
+        values = found[drawn[sampled]]
+    return values
+
+
+def _chunk(args):
+    return chunk_quantiles(*args)
+
+
+def rate_quantiles(matrix, method="bootstrap", samples=1000, quantiles=QUANTILES, seed=0, prior=0.5, chunk_entries=1_000_000, workers=1):
+    # one row per (combo, result) with its count, the combo's total, the observed rate, the resampled rate at each
+    # quantile and whether those are degenerate. prior is the dirichlet methods' pseudo count per seen result and for
+    # the other bucket. workers > 1 resamples chunks in that many processes (0 for one per core)
+    if method not in METHODS:
+        raise ValueError(f"unknown resampling method {method!r}, expected one of {', '.join(METHODS)}")
+    if samples < 1:
+        raise ValueError("samples must be at least 1")
+    indptr, data, totals = np.asarray(matrix.indptr), np.asarray(matrix.data), np.asarray(matrix.totals)
+    bounds = chunk_bounds(indptr, samples, chunk_entries)
+    seeds = np.random.SeedSequence(seed).spawn(len(bounds))
+    tasks = [(
+        indptr[start:stop + 1] - indptr[start], data[indptr[start]:indptr[stop]], totals[start:stop],
+        method, samples, list(quantiles), prior, child,
+    ) for (start, stop), child in zip(bounds, seeds)]
+    workers = parallel.worker_count(workers)
+    if workers <= 1 or len(tasks) < 2:
+        parts = [_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(pool.map(_chunk, tasks))
+    values = np.concatenate(parts) if parts else np.empty((0, len(quantiles)))
+
+    rows = matrix.rows()
+    output_df = matrix.combos().iloc[rows].reset_index(drop=True)
+    output_df["Result"] = np.array(matrix.results, dtype=object)[np.asarray(matrix.indices)]
+    output_df["Count"] = data
+    output_df["Total Breeds"] = totals[rows]
+    output_df["Rate"] = data / totals[rows]
+    for i, q in enumerate(quantiles):
+        output_df[quantile_label(q)] = values[:, i]
+    output_df["Degenerate"] = (np.diff(indptr)[rows] == 1) & (method == "bootstrap")
+    return output_df
@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from breeding import split_elements
+
+
+# rollup cube of breed counts keyed by the parents' element combination instead of their exact species
+# the base cuboid holds one count per (parent element masks, island, torches, skin, result) and every coarser view
+# (the parents' combined elements, island type, torch bucket, the result's elements) is summed from the smallest
+# cuboid already computed, never from the rows, and cached
+#
+# dimensions, each coarser one derived from the finer one next to it:
+#   pair (the two parents' element masks, unordered) -> union (every element of both parents)
+#   island -> island_type (mirror islands pooled with their natural one)
+#   torches -> torch_bucket
+#   result -> result_elements
+#   skin
+
+COARSER = {"union": "pair", "island_type": "island", "torch_bucket": "torches", "result_elements": "result"}
+DIMENSIONS = ["pair", "union", "island", "island_type", "torches", "torch_bucket", "skin", "result", "result_elements"]
+BASE = ["pair", "island", "torches", "skin", "result"]
+TORCH_BINS = (0, 1, 5, 10)  # lower edge of each torch bucket: "0", "1-4", "5-9", "10+"
+MIRROR_PREFIX = "M "
+
+
+def torch_labels(bins):
+    # "0", "1-4", "5-9", "10+" for the default bins
+    labels = [str(low) if high - low == 1 else f"{low}-{high - 1}" for low, high in zip(bins, bins[1:])]
+    return labels + [f"{bins[-1]}+"]
+
+
+class ElementCube:
+
+    def __init__(self, dataset, monsters, torch_bins=TORCH_BINS):
+        # dataset is a Dataset, monsters the Species/Elements frame (msm_monster_elements.csv)
+        element_lists = {name: split_elements(text) for name, text in zip(monsters["Species"], monsters["Elements"])}
+        self.elements = sorted({element for elements in element_lists.values() for element in elements})
+        if len(self.elements) > 62:
+            raise ValueError(f"{len(self.elements)} elements don't fit in a 64 bit mask")
+        bits = {element: 1 << i for i, element in enumerate(self.elements)}
+        self.species_masks = {name: sum(bits[element] for element in set(elements)) for name, elements in element_lists.items()}
+        self.identity = dataset.identity
+        self.torch_bins = tuple(torch_bins)
+        self.torch_bucket_labels = torch_labels(self.torch_bins)
+        self._cuboids = {frozenset(BASE): self._base(dataset)}
+
+    def mask_of(self, species):
+        # element mask of a species, its common form if the rarity isn't listed, 0 if unknown
+        if species in self.species_masks:
+            return self.species_masks[species]
+        return self.species_masks.get(self.identity.common_name(species), 0) if isinstance(species, str) else 0
+
+    def element_mask(self, elements):
+        # mask of an element list or "Plant, Cold" text
+        elements = split_elements(elements) if isinstance(elements, str) else list(elements)
+        unknown = [element for element in elements if element not in self.elements]
+        if unknown:
+            raise ValueError(f"unknown elements: {', '.join(unknown)}")
+        return sum(1 << self.elements.index(element) for element in set(elements))
+
+    def element_names(self, mask):
+        return ", ".join(element for i, element in enumerate(self.elements) if int(mask) >> i & 1) or "unknown"
+
+    def _masks(self, names):
+        # element mask per row, by the identity id of its name (see identity.py)
+        ids = self.identity.codes(names if isinstance(names, pd.Series) else pd.Series(names, dtype=object))
+        masks = np.array([self.mask_of(name) for name in self.identity.names] + [0], dtype=np.int64)
+        return masks[ids]
+
+    def _base(self, dataset):
+        pairs = dataset.canonical_pairs()
+        mask1, mask2 = self._masks(pairs["Parent 1 Species"]), self._masks(pairs["Parent 2 Species"])
+        rows = pd.DataFrame({
+            "pair_low": np.minimum(mask1, mask2),
+            "pair_high": np.maximum(mask1, mask2),
+            "island": dataset.get_col_by_name(dataset.schema.island).to_numpy(dtype=object),
+            "torches": dataset.torch_col.to_numpy(dtype=np.float64, na_value=np.nan),
+            "skin": dataset.skin_col.to_numpy(dtype=object),
+            "result": dataset.result_col.to_numpy(dtype=object),
+        })
+        return rows.groupby(list(rows.columns), dropna=False).size().rename("count").reset_index()
+
+    @staticmethod
+    def _columns(dims):
+        return [col for dim in dims for col in (("pair_low", "pair_high") if dim == "pair" else (dim,))]
+
+    def _derive(self, frame, dim):
+        # adds a coarser dimension's column from its finer one
+        if dim == "union":
+            frame[dim] = frame["pair_low"] | frame["pair_high"]
+        elif dim == "island_type":
+            frame[dim] = [name[len(MIRROR_PREFIX):] if isinstance(name, str) and name.startswith(MIRROR_PREFIX) else name for name in frame["island"]]
+        elif dim == "torch_bucket":
+            torches = frame["torches"].to_numpy()
+            bucket = np.digitize(torches, self.torch_bins[1:])
+            labels = np.array(self.torch_bucket_labels, dtype=object)[bucket]
+            frame[dim] = np.where(np.isnan(torches), None, labels)
+        elif dim == "result_elements":
+            frame[dim] = self._masks(frame["result"])
+        return frame
+
+    def cuboid(self, dims):
+        # counts summed over every dimension not in dims, from the smallest cached cuboid that has them
+        dims = frozenset(dims)
+        unknown = dims - set(DIMENSIONS)
+        if unknown:
+            raise ValueError(f"unknown dimensions {sorted(unknown)}, expected some of {DIMENSIONS}")
+        if dims not in self._cuboids:
+            def covers(have):
+                return all(dim in have or COARSER.get(dim) in have for dim in dims)
+            source_dims = min((have for have in self._cuboids if covers(have)), key=lambda have: len(self._cuboids[have]))
+            frame = self._cuboids[source_dims].copy()
+            for dim in dims - source_dims:
+                frame = self._derive(frame, dim)
+            columns = self._columns([dim for dim in DIMENSIONS if dim in dims])
+            if columns:
+                frame = frame.groupby(columns, dropna=False)["count"].sum().reset_index()
+            else:
+                frame = pd.DataFrame({"count": [frame["count"].sum()]})
+            self._cuboids[dims] = frame
+        return self._cuboids[dims]
+
+    def rollup(self, dims, labels=True):
+        # counts per combination of dims with each count's share of its group without result/result_elements, e.g.
+        # cube.rollup(["union", "torch_bucket", "result"]). labels turns element masks into "Cold, Plant" text
+        dims = list(dict.fromkeys(dims))
+        frame = self.cuboid(dims).copy()
+        group = self._columns([dim for dim in DIMENSIONS if dim in dims and dim not in ("result", "result_elements")])
+        total = frame.groupby(group, dropna=False)["count"].transform("sum") if group else frame["count"].sum()
+        frame["share"] = frame["count"] / total
+        return self.labelled(frame) if labels else frame
+
+    def drill(self, by, **fixed):
+        # rollup by the by dimensions (one or a list) of only the cells matching fixed, e.g.
+        # cube.drill("island_type", union="Plant, Cold", torch_bucket="10+"). element dimensions take masks or names,
+        # pair takes a (elements, elements) tuple
+        by = [by] if isinstance(by, str) else list(by)
+        frame = self.cuboid(set(by) | set(fixed) | {"result"}).copy()
+        keep = np.ones(len(frame), dtype=bool)
+        for dim, value in fixed.items():
+            if dim == "pair":
+                masks = sorted(v if isinstance(v, (int, np.integer)) else self.element_mask(v) for v in value)
+                keep &= (frame["pair_low"] == masks[0]).to_numpy() & (frame["pair_high"] == masks[1]).to_numpy()
+            elif dim in ("union", "result_elements") and not isinstance(value, (int, np.integer)):
+                keep &= (frame[dim] == self.element_mask(value)).to_numpy()
+            else:
+                keep &= (frame[dim] == value).to_numpy()
+        frame = frame[keep]
+        frame = frame.groupby(self._columns([dim for dim in DIMENSIONS if dim in by or dim == "result"]), dropna=False)["count"].sum().reset_index()
+        group = self._columns([dim for dim in DIMENSIONS if dim in by and dim not in ("result", "result_elements")])
+        frame["share"] = frame["count"] / (frame.groupby(group, dropna=False)["count"].transform("sum") if group else frame["count"].sum())
+        return self.labelled(frame)
+
+    def labelled(self, frame):
+        frame = frame.copy()
+        for col in ("pair_low", "pair_high", "union", "result_elements"):
+            if col in frame:
+                frame[col] = [self.element_names(mask) for mask in frame[col]]
+        return frame.reset_index(drop=True)
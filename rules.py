@@ -0,0 +1,147 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import schema
+from profiling import NULL_TRACER
+
+
+# validation rules for main.py
+# each rule is a vectorised predicate returning True for rows that pass, and owns one bit of a per-row bitmask
+# rules run on the typed frame (see schema.to_typed), ctx["schema"] gives the actual column names
+# monster names are checked through ctx["identity"], the shared MonsterIdentity (see identity.py), per category
+# bits are assigned in registration order so a given bit always means the same rule, add new rules at the end
+
+RULES = OrderedDict()  # {rule name: Rule}
+
+
+class Rule:
+
+    def __init__(self, name, bit, predicate, description):
+        self.name = name
+        self.bit = bit
+        self.predicate = predicate
+        self.description = description
+
+    def __repr__(self):
+        return f"Rule({self.name!r}, bit={self.bit})"
+
+
+def rule(name, description):
+    # registers the decorated predicate(df, ctx) as a rule, ctx holds the lists the rules check against
+    def decorator(predicate):
+        if name in RULES:
+            raise ValueError(f"rule {name} is already registered")
+        RULES[name] = Rule(name, len(RULES), predicate, description)
+        return predicate
+    return decorator
+
+
+@rule("date", "the date exists and is valid")
+def valid_date(df, ctx):
+    return df[ctx["schema"].date].notna()
+
+
+@rule("daynight", "for paironormals, at least one of the day/night columns is true")
+def day_or_night(df, ctx):
+    cols = ctx["schema"]
+    return (df[cols.day].fillna(False) | df[cols.night].fillna(False)).astype(bool)
+
+
+@rule("time", "time since reset exists and is a valid duration")
+def valid_time_since_reset(df, ctx):
+    durations = schema.convert_categories(df[ctx["schema"].time], lambda values: pd.to_timedelta(values, errors="coerce"), "timedelta64[ns]")
+    return durations.notna()
+
+
+@rule("island", "the island name is in the list of possible island names")
+def island_exists(df, ctx):
+    return df[ctx["schema"].island].isin(ctx["island_names"])
+
+
+@rule("skin", "titan skin is either true or false")
+def valid_titan_skin(df, ctx):
+    return df[ctx["schema"].skin].notna()
+
+
+@rule("torches", "torches is a number between 0-10")
+def valid_torch_count(df, ctx):
+    return df[ctx["schema"].torches].between(0, 10).fillna(False).astype(bool)
+
+
+@rule("parents", "both parents are in the list of monsters that can breed")
+def parents_exist(df, ctx):
+    cols = ctx["schema"]
+    identity, parents = ctx["identity"], ctx["parent_monsters"]
+    return identity.isin(df[cols.parent1], parents) & identity.isin(df[cols.parent2], parents)
+
+
+@rule("levels", "both parent levels exist and are between 4-20")
+def valid_parent_levels(df, ctx):
+    cols = ctx["schema"]
+    ok = df[cols.parent1_level].between(4, 20) & df[cols.parent2_level].between(4, 20)
+    return ok.fillna(False).astype(bool)
+
+
+@rule("result", "the result is in the list of monsters that can be bred")
+def result_exists(df, ctx):
+    return ctx["identity"].isin(df[ctx["schema"].result], ctx["result_monsters"])
+
+
+@rule("availability", "event monsters were available on the date of breeding")
+def result_available(df, ctx):
+    cols = ctx["schema"]
+    return ctx["availabilities"].is_available(df[cols.result], df[cols.date])
+
+
+@rule("breed", "the result could be bred from the parents, by elements, island quads or special combos")
+def breed_possible(df, ctx):
+    cols = ctx["schema"]
+    return ctx["breeding"].is_possible(df[cols.parent1], df[cols.parent2], df[cols.result])
+
+
+def evaluate(df, rule_names, ctx, tracer=NULL_TRACER):
+    # runs the named rules over the frame, returns a uint32 bitmask per row with a bit set for each failed rule
+    # tracer gets a span per rule with the rows passing it as rows_out, see profiling.py
+    mask = np.zeros(len(df), dtype=np.uint32)
+    for name in rule_names:
+        current = RULES[name]
+        with tracer.span(name, "rule", len(df)) as span:
+            ok = np.asarray(current.predicate(df, ctx), dtype=bool)
+            mask |= (~ok).astype(np.uint32) << np.uint32(current.bit)
+            if tracer.enabled:
+                span.rows_out = int(ok.sum())
+    return pd.Series(mask, index=df.index, name="violations")
+
+
+def rule_counts(mask, rule_names=None):
+    # {rule name: number of rows violating it}, in bit order
+    mask = np.asarray(mask, dtype=np.uint32)
+    names = rule_names if rule_names is not None else RULES.keys()
+    return {name: int(((mask >> np.uint32(RULES[name].bit)) & 1).sum()) for name in names}
+
+
+def rules_from_mask(value):
+    # names of the rules set in a single row's bitmask
+    return [name for name, current in RULES.items() if int(value) >> current.bit & 1]
+
+
+def mask_from_rules(names):
+    # a single row's bitmask from its rule names, the inverse of rules_from_mask
+    return sum(1 << RULES[name].bit for name in names if name in RULES)
+
+
+def write_quarantine(df, mask, output_file, mode="w"):
+    # violating rows with their bitmask and rule names as json lines, instead of printing them
+    # mode "a" appends, for writing chunk by chunk
+    bad = mask.to_numpy() != 0
+    if not bad.any():
+        # pandas would still write an empty line, "w" just leaves an empty file
+        if mode == "w":
+            open(output_file, "w").close()
+        return 0
+    quarantined = df[bad].copy()
+    quarantined.insert(0, "row", quarantined.index)
+    quarantined.insert(1, "violations", mask[bad].astype(np.int64))
+    quarantined.insert(2, "rules", [",".join(rules_from_mask(value)) for value in mask[bad]])
+    quarantined.to_json(output_file, orient="records", lines=True, force_ascii=False, mode=mode)
+    return len(quarantined)
@@ -0,0 +1,197 @@
+from io import StringIO
+import pandas as pd
+import numpy as np
+from availability import MSM_DATE_FORMAT
+
+
+# the master sheet's columns by logical name: (text the sheet column contains, kind)
+# the sheet adds newlines/extra text to headers now and then, so columns are matched on a substring once and then
+# referred to by logical name everywhere else
+# kinds: category for names, int for levels/torches (nullable Int16), bool for flags (nullable boolean), date
+COLUMNS = {
+    "source": ("Source", "category"),
+    "date": ("Date", "date"),
+    "time": ("Time since reset", "category"),
+    "day": ("Day?", "bool"),
+    "night": ("Night?", "bool"),
+    "torches": ("Torches", "int"),
+    "island": ("Island", "category"),
+    "skin": ("Titan", "bool"),
+    "parent1": ("Parent 1 Species", "category"),
+    "parent1_level": ("Parent 1 Level", "int"),
+    "parent2": ("Parent 2 Species", "category"),
+    "parent2_level": ("Parent 2 Level", "int"),
+    "result": ("Result", "category"),
+}
+
+BOOL_VALUES = {"true": True, "false": False, "1": True, "0": False}
+
+# pandas dtypes used once a column is typed
+DTYPES = {"category": "category", "int": "Int16", "bool": "boolean"}
+
+
+class Schema:
+    # resolves every logical column against the actual column names once
+    # attributes are the actual names, e.g. schema.island == "Island", None if the column isn't there
+
+    def __init__(self, columns):
+        self.actual = list(columns)
+        self.columns = {logical: self.find(needle) for logical, (needle, _) in COLUMNS.items()}
+
+    def find(self, needle):
+        for col in self.actual:
+            if needle in col:
+                return col
+        return None
+
+    def __getattr__(self, logical):
+        columns = self.__dict__.get("columns", {})
+        if logical in columns:
+            return columns[logical]
+        raise AttributeError(logical)
+
+    def kind(self, col):
+        for logical, actual in self.columns.items():
+            if actual == col:
+                return COLUMNS[logical][1]
+        return "category"
+
+    def read_dtypes(self):
+        # dtypes for pd.read_csv of a cleaned export, dates are parsed separately with a fixed format
+        return {col: DTYPES.get(self.kind(col), "category") for col in self.actual if self.kind(col) != "date"}
+
+
+# flattens the two header rows of the master sheet into one, e.g. "Parent 1" + "Unnamed: 9" -> "Parent 1 Level"
+def flatten_columns(columns):
+    names = []
+    unnamed_col_count = 0
+    for col in columns:
+        if "Unnamed" in col:
+            col = f"{names[-1]} Level"
+            unnamed_col_count += 1
+        # replaces newlines with spaces and strips double quotes
+        col = col.replace("\n", " ").replace('"', "")
+        names.append(col)
+
+    if unnamed_col_count > 2:
+        raise ValueError("there should only be two unnamed columns, one for each parent level")
+
+    # renaming the old Parent 1/2 columns to Parent 1/2 Species to fit with the flattened structure
+    renames = {"Parent 1": "Parent 1 Species", "Parent 2": "Parent 2 Species"}
+    return [renames.get(col, col) for col in names]
+
+
+def read_sheet(text):
+    # parses the master sheet export in one pass, every column is read as a categorical of the raw text so each
+    # distinct value is stored once and later converted once (see to_typed)
+    df = pd.read_csv(StringIO(text), header=0, dtype="category")
+    df.columns = flatten_columns(df.columns)
+    # drops the second header row which is now redundant
+    df = df.drop(index=0).reset_index(drop=True)
+    for col in df.columns:
+        df[col] = df[col].cat.remove_unused_categories()
+    return df
+
+
+def read_sheet_chunks(source, chunk_rows):
+    # read_sheet for sheets too big to hold at once, yields flattened chunks of up to chunk_rows rows from a path or
+    # file object. the header is flattened once and every row keeps its position in the whole sheet as its index
+    columns = None
+    for chunk in pd.read_csv(source, header=0, dtype="category", chunksize=chunk_rows):
+        if columns is None:
+            columns = flatten_columns(chunk.columns)
+            # the second header row
+            chunk = chunk.drop(index=0)
+        chunk.columns = columns
+        chunk.index = chunk.index - 1
+        for col in chunk.columns:
+            chunk[col] = chunk[col].cat.remove_unused_categories()
+        yield chunk
+
+
+def convert_categories(series, func, dtype):
+    # converts each distinct value of a categorical once and broadcasts the results back through the codes
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        series = series.astype("category")
+    categories = pd.Series(series.cat.categories)
+    converted = pd.Series(func(categories)).astype(dtype)
+    # blank entries have code -1, which picks the NA appended at the end
+    lookup = pd.concat([converted, pd.Series([pd.NA], dtype=dtype)], ignore_index=True)
+    codes = series.cat.codes.to_numpy()
+    codes = np.where(codes < 0, len(categories), codes)
+    return pd.Series(lookup.array[codes], index=series.index, name=series.name)
+
+
+def map_categories(series, func):
+    # applies func to each distinct value of a categorical, values that end up the same share one category
+    codes = series.cat.codes.to_numpy()
+    new_codes, uniques = pd.factorize(pd.Series([func(value) for value in series.cat.categories], dtype=object))
+    new_codes = np.append(new_codes, -1)  # blanks (code -1) stay blank
+    return pd.Series(pd.Categorical.from_codes(new_codes[codes], categories=uniques), index=series.index, name=series.name)
+
+
+def count_changed(series, func):
+    # number of non-blank rows func would change, computed per distinct value
+    codes = series.cat.codes.to_numpy()
+    changed = np.array([func(value) != value for value in series.cat.categories] + [False], dtype=bool)
+    return int(changed[codes].sum())
+
+
+def fill_blanks(series, value):
+    if value not in series.cat.categories:
+        series = series.cat.add_categories([value])
+    return series.fillna(value)
+
+
+def parse_int(values):
+    # small whole numbers only, anything else (text, decimals, huge values) is NA so it fails validation
+    numbers = pd.to_numeric(values, errors="coerce")
+    valid = numbers.notna() & (numbers == numbers.round()) & numbers.between(-32768, 32767)
+    return numbers.where(valid)
+
+
+def parse_bool(values):
+    return values.astype(str).str.strip().str.lower().map(BOOL_VALUES)
+
+
+def parse_date(values):
+    return pd.to_datetime(values, format=MSM_DATE_FORMAT, errors="coerce")
+
+
+PARSERS = {"int": (parse_int, "Int16"), "bool": (parse_bool, "boolean"), "date": (parse_date, "datetime64[ns]")}
+
+
+def to_typed(df, schema):
+    # converts the raw text columns to their typed dtypes, names stay categorical
+    df = df.copy()
+    for col in df.columns:
+        kind = schema.kind(col)
+        if kind in PARSERS:
+            func, dtype = PARSERS[kind]
+            df[col] = convert_categories(df[col], func, dtype)
+        elif not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def format_dates(dates):
+    # back to the sheet's M/D/YYYY text, formatting each distinct date once
+    codes, uniques = pd.factorize(dates)
+    text = np.array([f"{d.month}/{d.day}/{d.year}" for d in uniques] + [None], dtype=object)
+    return pd.Series(text[codes], index=dates.index, name=dates.name)
+
+
+def for_export(df, schema):
+    # the cleaned frame as it is written to csv, dates go back to the sheet's format
+    if schema.date in df.columns and pd.api.types.is_datetime64_any_dtype(df[schema.date]):
+        df = df.copy()
+        df[schema.date] = format_dates(df[schema.date])
+    return df
+
+
+def read_cleaned(csv_file):
+    # reads a cleaned export (msm_data.csv) in one pass with explicit dtypes
+    schema = Schema(pd.read_csv(csv_file, nrows=0).columns)
+    parse_dates = [schema.date] if schema.date else None
+    df = pd.read_csv(csv_file, dtype=schema.read_dtypes(), parse_dates=parse_dates, date_format=MSM_DATE_FORMAT)
+    return df, schema
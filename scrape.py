@@ -1,10 +1,18 @@
+import os
+import re
 import requests
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup, SoupStrainer, Tag
 import pandas as pd
 from collections import OrderedDict, defaultdict
-import sqlite3
+from monster_store import MonsterStore, MONSTER_DB, content_hash
+from names import norm_text, norm_key
+from identity import RARITIES, split_rarity
 
 url = "https://mysingingmonsters.fandom.com/wiki/Monsters"
+api_url = "https://mysingingmonsters.fandom.com/api.php"
+PAGE_TITLE = "Monsters"
+PAGE_CACHE_DIR = "./intermediary logs/wiki_cache"  # raw page html saved per revision, None to always download
+MONSTER_TABLES = 12  # the first 12 tables have the monster data, the rest is wiki nav
 
 
 # the script auto-detects elements that have "Element" in the tag title (e.g. Air_Element, Water_Element)
@@ -66,30 +74,9 @@ def apply_mythical_override(common_key: str, elements: list[str]) -> list[str]:
     return out
 
 
-def norm_text(s: str) -> str:
-    if s is None:
-        return ""
-    return " ".join(s.replace("\xa0", " ").strip().split())
-
-
-# makes all quotes the same and lowercases
-def norm_key(name: str) -> str:
-    return norm_text(name).replace("\u2019", "'").lower()
-
-
 MYTHICAL_TYPE_BY_KEY = {norm_key(k): v for k, v in TRUE_MYTHICAL_TYPE.items()}
 
 
-# makes rare/epic/adult variants map to their common monster
-def common_key_from_variant(name: str) -> str:
-    norm = norm_text(name)
-    lower = norm.lower()
-    for pref in ("rare ", "epic ", "adult "):
-        if lower.startswith(pref):
-            return norm_key(norm[len(pref):])
-    return norm_key(norm)
-
-
 # skips the headers of tables
 def is_header_row(tr: Tag) -> bool:
     return tr.find("th", recursive=False) is not None
@@ -106,8 +93,7 @@ def monster_name_from_td(td: Tag):
 
 # separates primordial elements from regular ones by checking the image URL (the only difference???)
 def span_is_primordial(span: Tag) -> bool:
-    a = span.find("a")
-    img = a.find("img")
+    img = span.a.img
     if not img:
         return False
 
@@ -117,34 +103,42 @@ def span_is_primordial(span: Tag) -> bool:
     return "primordial" in ((src or "") + (data_src or "")).lower()
 
 
-# insanely convoluted way to detect if we are currently looking at an element icon
-def element_from_span(span: Tag) -> str | None:
-    a = span.find("a")
+# works out the element from an icon's tag title, None if it isn't an element icon
+def element_from_title(title: str) -> str | None:
+    title = norm_text(title)
+    # "... Element"
+    if title.endswith(" Element"):
+        return title[:-len(" Element")].strip() or None
+    # "Element ..."
+    if title.startswith("Element "):
+        return title[len("Element "):].strip() or None
+    # known element names that don't include the word "Element" in the tag title e.g. "Legendary Monsters" element
+    return check_known_elements(title)
+
+
+def icon_title(a: Tag) -> str:
+    return a.get("title") or a.get_text(strip=True)
+
+
+# the same few dozen icon titles repeat thousands of times, so each distinct title is resolved once up front
+def build_element_map(tables) -> dict:
+    titles = {icon_title(span.a) for table in tables for span in table.find_all("span", attrs={"typeof": "mw:File"}) if span.a}
+    return {title: element_from_title(title) for title in titles}
+
+
+# detects if we are currently looking at an element icon, element_map is from build_element_map
+def element_from_span(span: Tag, element_map: dict) -> str | None:
+    a = span.a
     if not a:
         return None
-    title = norm_text(a.get("title") or a.get_text(strip=True))
-    if not title:
+    title = icon_title(a)
+    if not norm_text(title):
         return None
 
-    element = None
-
-    # "... Element"
-    if title.endswith(" Element"):
-        element = title[:-len(" Element")].strip()
-    # "Element ..."
-    elif title.startswith("Element "):
-        element = title[len("Element "):].strip()
-    else:
-        # known element names that don't include the word "Element" in the tag title e.g. "Legendary Monsters" element
-        known = check_known_elements(title)
-        if known:
-            element = known
-        else:
-            # tries <a> text in case tooltip is missing or wrong
-            txt = norm_text(a.get_text(strip=True))
-            known2 = check_known_elements(txt)
-            if known2:
-                element = known2
+    element = element_map[title] if title in element_map else element_from_title(title)
+    if not element:
+        # tries <a> text in case tooltip is missing or wrong
+        element = check_known_elements(a.get_text(strip=True))
     # not an element
     if not element:
         return None
@@ -154,7 +148,7 @@ def element_from_span(span: Tag) -> str | None:
     return element
 
 
-def elements_from_td(td: Tag):
+def elements_from_td(td: Tag, element_map: dict):
     # all are <span typeof="mw:File">. first is monster image, rest are element icons (hopefully)
     spans = td.find_all("span", attrs={"typeof": "mw:File"})
     if len(spans) < 2:
@@ -163,95 +157,200 @@ def elements_from_td(td: Tag):
     # try all but first
     labels = []
     for span in spans[1:]:
-        label = element_from_span(span)
+        label = element_from_span(span, element_map)
         if label:
             labels.append(label)
 
     # remove duplicates
-    out, seen = [], set()
-    for i in labels:
-        if i not in seen:
-            out.append(i)
-            seen.add(i)
+    return list(dict.fromkeys(labels))
 
-    return out
 
+# lxml is optional, it parses a lot faster than the builtin parser
+def html_parser() -> str:
+    try:
+        import lxml  # noqa: F401
+        return "lxml"
+    except ImportError:
+        return "html.parser"
+
+
+# opening tag of an article table, in document order like soup.select would find them
+ARTICLE_TABLE_TAG = re.compile(r'<table\b[^>]*\bclass="[^"]*\barticle-table\b', re.IGNORECASE)
+
+
+# the page text of each monster table, from its opening tag to the start of the next article table, so the page head,
+# scripts and wiki nav are never tokenised and each table can be hashed on its own
+def monster_table_slices(html: str) -> list[str]:
+    starts = [match.start() for match, _ in zip(ARTICLE_TABLE_TAG.finditer(html), range(MONSTER_TABLES + 1))]
+    if not starts:
+        return []
+    ends = starts[1:] if len(starts) > MONSTER_TABLES else starts[1:] + [len(html)]
+    return [html[start:end] for start, end in zip(starts, ends)]
+
+
+def monster_tables_html(html: str) -> str:
+    return "".join(monster_table_slices(html))
+
+
+# only the monster tables are built into the tree, anything else left in the slice is skipped while parsing
+def monster_tables(html: str, parser: str | None = None):
+    strainer = SoupStrainer("table", class_="article-table")
+    soup = BeautifulSoup(monster_tables_html(html), parser or html_parser(), parse_only=strainer)
+    return soup.find_all("table", class_="article-table", limit=MONSTER_TABLES)
 
-# scrape logic
 
-resp = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=30)
-resp.raise_for_status()
-soup = BeautifulSoup(resp.text, "html.parser")
+# asking for the revision id is a tiny request, the page itself is only downloaded when it changed
+def latest_revision(session) -> int:
+    resp = session.get(api_url, params={
+        "action": "query", "prop": "revisions", "titles": PAGE_TITLE, "rvprop": "ids", "format": "json", "formatversion": "2",
+    }, timeout=30)
+    resp.raise_for_status()
+    return int(resp.json()["query"]["pages"][0]["revisions"][0]["revid"])
 
-tables = soup.select("table.article-table")[:12]  # the first 12 tables have the monster data, the rest is wiki nav
 
-# keeping track of common monsters seen + their elements, then link rare/epic/adult variants found
-elements_by_common = OrderedDict()
-variants_by_common = defaultdict(lambda: {"rare": False, "epic": False, "adult": False})
+def fetch_page(session, cache_dir=PAGE_CACHE_DIR) -> tuple[str, int | None, bool]:
+    # (html, revision id, came from cache)
+    try:
+        revision = latest_revision(session)
+    except (requests.RequestException, ValueError, KeyError, IndexError):
+        revision = None
 
-for tbl in tables:
+    if revision is not None and cache_dir:
+        path = os.path.join(cache_dir, f"{PAGE_TITLE}_{revision}.html")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                return f.read(), revision, True
+
+    resp = session.get(url, timeout=30)
+    resp.raise_for_status()
+    html = resp.text
+    if revision is None:
+        # the page states its own revision id
+        found = re.search(r'"wgRevisionId":(\d+)', html)
+        revision = int(found.group(1)) if found else None
+    if revision is not None and cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(os.path.join(cache_dir, f"{PAGE_TITLE}_{revision}.html"), "w", encoding="utf-8") as f:
+            f.write(html)
+    return html, revision, False
+
+
+# scrape logic
+
+def cells_from_table(tbl: Tag, element_map: dict) -> list:
+    # [(monster name, [elements])] for every monster cell in the table, in page order
+    cells = []
     tbody = tbl.find("tbody") or tbl
     for tr in tbody.find_all("tr", recursive=False):
         if is_header_row(tr):
             continue
         for td in tr.find_all("td", recursive=False):
             name = monster_name_from_td(td)
-            if not name:
-                continue
-
-            elements = elements_from_td(td)
-            # common monsters have elements listed, so we can add them directly
-            if elements:
-                key = norm_key(name)
-                display_name = fix_casing(name)
-                if key not in elements_by_common:
-                    elements_by_common[key] = {"display": display_name, "elements": elements}
-                else:
-                    # merge elements if we see it again
-                    current = elements_by_common[key]["elements"]
-                    for element in elements:
-                        if element not in current:
-                            current.append(element)
-
-            # rare/epic/adult variants get their elements from the common monster later
-            # this is because we might not have encountered the common monster yet
+            if name:
+                cells.append((name, elements_from_td(td, element_map)))
+    return cells
+
+
+def rows_from_tables(tables, element_map=None) -> pd.DataFrame:
+    # Species/Elements frame from the monster tables
+    if element_map is None:
+        element_map = build_element_map(tables)
+    return rows_from_cells([cell for tbl in tables for cell in cells_from_table(tbl, element_map)])
+
+
+def rows_from_cells(cells) -> pd.DataFrame:
+    # keeping track of common monsters seen + their elements, then link rare/epic/adult variants found
+    elements_by_common = OrderedDict()
+    variants_by_common = defaultdict(lambda: {"rare": False, "epic": False, "adult": False})
+
+    for name, elements in cells:
+        # common monsters have elements listed, so we can add them directly
+        if elements:
+            key = norm_key(name)
+            display_name = fix_casing(name)
+            if key not in elements_by_common:
+                elements_by_common[key] = {"display": display_name, "elements": list(elements)}
             else:
-                low = norm_text(name).lower()
-                if low.startswith("rare "):
-                    common_key = common_key_from_variant(name)
-                    variants_by_common[common_key]["rare"] = True
-                elif low.startswith("epic "):
-                    common_key = common_key_from_variant(name)
-                    variants_by_common[common_key]["epic"] = True
-                elif low.startswith("adult "):
-                    common_key = common_key_from_variant(name)
-                    variants_by_common[common_key]["adult"] = True
-
-# generating the final list of rows for the csv
-ordered_rows = []  # (display name, [elements])
-for common_key, info in elements_by_common.items():
-    common_display_name = info["display"]
-    elements = apply_mythical_override(common_key, info["elements"])
-
-    # place common first
-    ordered_rows.append((common_display_name, elements))
-
-    # then common, rare, epic versions
-    variants = variants_by_common.get(common_key, {})
-    if variants.get("rare"):
-        ordered_rows.append((f"Rare {common_display_name}", elements))
-    if variants.get("epic"):
-        ordered_rows.append((f"Epic {common_display_name}", elements))
-    if variants.get("adult"):
-        ordered_rows.append((f"Adult {common_display_name}", elements))
-
-# csv for free
-df = pd.DataFrame({
-    "Species": [m for m, _ in ordered_rows],
-    "Elements": [", ".join(e) for _, e in ordered_rows],
-})
-df.to_csv("./other data/msm_monster_elements.csv", index=False)
-print(f"Saved {len(df)} rows to ./other data/msm_monster_elements.csv")
-
-
-
+                # merge elements if we see it again
+                current = elements_by_common[key]["elements"]
+                for element in elements:
+                    if element not in current:
+                        current.append(element)
+
+        # rare/epic/adult variants get their elements from the common monster later
+        # this is because we might not have encountered the common monster yet
+        else:
+            rarity, common = split_rarity(norm_text(name))
+            if rarity:
+                variants_by_common[norm_key(common)][RARITIES[rarity]] = True
+
+    # generating the final list of rows for the csv
+    ordered_rows = []  # (display name, [elements])
+    for common_key, info in elements_by_common.items():
+        common_display_name = info["display"]
+        elements = apply_mythical_override(common_key, info["elements"])
+
+        # place common first
+        ordered_rows.append((common_display_name, elements))
+
+        # then common, rare, epic versions
+        variants = variants_by_common.get(common_key, {})
+        if variants.get("rare"):
+            ordered_rows.append((f"Rare {common_display_name}", elements))
+        if variants.get("epic"):
+            ordered_rows.append((f"Epic {common_display_name}", elements))
+        if variants.get("adult"):
+            ordered_rows.append((f"Adult {common_display_name}", elements))
+
+    # frame for the csv
+    df = pd.DataFrame({
+        "Species": [m for m, _ in ordered_rows],
+        "Elements": [", ".join(e) for _, e in ordered_rows],
+    })
+    return df
+
+
+def parse_monster_elements(html: str, parser: str | None = None) -> pd.DataFrame:
+    return rows_from_tables(monster_tables(html, parser))
+
+
+def parse_incremental(html: str, store: MonsterStore, parser: str | None = None) -> tuple[pd.DataFrame, int]:
+    # like parse_monster_elements, but tables whose html hash is unchanged since the last scrape reuse their stored
+    # cells instead of being parsed. returns (frame, number of tables parsed)
+    strainer = SoupStrainer("table", class_="article-table")
+    slices = monster_table_slices(html)
+    cells, parsed = [], 0
+    for position, text in enumerate(slices):
+        table_hash = content_hash(text)
+        table_cells = store.table_cells(position, table_hash)
+        if table_cells is None:
+            tbl = BeautifulSoup(text, parser or html_parser(), parse_only=strainer).find("table", class_="article-table")
+            table_cells = cells_from_table(tbl, build_element_map([tbl])) if tbl else []
+            store.set_table_cells(position, table_hash, table_cells)
+            parsed += 1
+        cells.extend(table_cells)
+    store.truncate_tables(len(slices))
+    return rows_from_cells(cells), parsed
+
+
+if __name__ == "__main__":
+    session = requests.Session()
+    session.headers["User-Agent"] = "Mozilla/5.0"
+    html, revision, cached = fetch_page(session)
+    print(f"{'Cached' if cached else 'Downloaded'} {PAGE_TITLE} page, revision {revision}")
+
+    # parsed tables and monster rows are kept in sqlite, only what changed since the last scrape is redone
+    store = MonsterStore(MONSTER_DB)
+    df, parsed = parse_incremental(html, store)
+    added, changed, removed = store.upsert_monsters(df, revision)
+    store.set_mythical_overrides(TRUE_MYTHICAL_TYPE)
+    store.set_meta("revision", revision)
+    store.close()
+    print(f"Parsed {parsed} changed tables, {added} monsters added, {changed} changed, {removed} removed")
+
+    csv_file = "./other data/msm_monster_elements.csv"
+    if os.path.exists(csv_file) and pd.read_csv(csv_file, keep_default_na=False).equals(df):
+        print(f"{csv_file} is already up to date")
+    else:
+        df.to_csv(csv_file, index=False)
+        print(f"Saved {len(df)} rows to {csv_file}")
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pipeline
+
+
+# watch mode: one long running process instead of a cron job. the sheets are polled every WATCH_INTERVAL seconds with
+# conditional requests and the pipeline only reruns when their content hash changes. the cleaned data and grouped
+# results stay in memory and are served on 127.0.0.1:SERVE_PORT as pre-serialised responses with ETags
+# GET /cleaned.csv, /grouped.csv, /status and /probability?parent1=Noggin&parent2=Mammott&result=Bowgart (see
+# OutcomeIndex.probability for the other parameters). run it offline against OFFLINE_SHEETS_DIR to test it
+
+SERVE_HOST = "127.0.0.1"
+
+
+def make_response(body, content_type):
+    # (body bytes, content type, etag)
+    return body, content_type, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def json_response(value):
+    return make_response(json.dumps(value, default=str).encode("utf-8"), "application/json")
+
+
+def query_value(name, text):
+    # typed value of a /probability parameter, levels and torches are whole numbers and skin true/false
+    if text == "*":
+        return text
+    if name in ("level1", "level2", "torches"):
+        return int(text)
+    if name == "skin":
+        return text.lower() in ("true", "1", "yes")
+    if name == "confidence":
+        return float(text)
+    return text
+
+
+class Service:
+
+    def __init__(self, options):
+        self.options = options
+        self.fetcher = None  # shared between polls so the cache and the session's connections are reused
+        self.digest = None
+        self.pipeline = None  # the latest run, holding the cleaned frame and its Dataset
+        self.responses = {}
+        self.status = {"polls": 0, "runs": 0, "last_poll": None, "last_change": None, "rows": None, "error": None}
+        self.lock = threading.Lock()
+
+    def poll(self):
+        # fetches both sheets and reruns the pipeline if either changed, returns whether it did
+        run = pipeline.Pipeline(self.options)
+        run.fetcher = self.fetcher
+        run.fetch()
+        self.fetcher = run.fetcher
+        self.status["polls"] += 1
+        self.status["last_poll"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        if run.keys["fetch"] == self.digest:
+            print("Sheets unchanged, results kept")
+            return False
+
+        run.run()
+        responses = {}
+        for path, csv_file in (("/cleaned.csv", pipeline.CLEANED_CSV), ("/grouped.csv", pipeline.GROUPED_CSV)):
+            with open(csv_file, "rb") as f:
+                responses[path] = make_response(f.read(), "text/csv; charset=utf-8")
+        with self.lock:
+            self.pipeline, self.digest, self.responses = run, run.keys["fetch"], responses
+            self.status["runs"] += 1
+            self.status["last_change"] = self.status["last_poll"]
+            self.status["rows"] = run.totals['cleaned'] if run.totals else len(run.dataset.df)
+            self.status["error"] = None
+        return True
+
+    def response(self, path, query):
+        # (status code, (body, content type, etag) or None)
+        if path == "/status":
+            with self.lock:
+                return 200, json_response({**self.status, "digest": self.digest})
+        if path == "/probability":
+            return self.probability(query)
+        with self.lock:
+            found = self.responses.get(path)
+        return (200, found) if found else (404, None)
+
+    def probability(self, query):
+        dataset = self.pipeline.dataset if self.pipeline is not None else None
+        if dataset is None:
+            return 503, json_response({"error": "no results yet, or streaming mode which doesn't keep them"})
+        names = ("parent1", "parent2", "result", "level1", "level2", "torches", "skin", "interval", "confidence")
+        try:
+            args = {name: query_value(name, values[-1]) for name, values in query.items() if name in names}
+            estimate = dataset.outcome_index().probability(**args)
+        except (TypeError, ValueError, KeyError, ImportError) as e:
+            return 400, json_response({"error": str(e)})
+        return 200, json_response({**args, **estimate._asdict()})
+
+    def serve(self, port):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                code, found = service.response(url.path, parse_qs(url.query))
+                if found is None:
+                    self.send_error(code)
+                    return
+                body, content_type, etag = found
+                if code == 200 and self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                self.send_response(code)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", "no-cache")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((SERVE_HOST, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving results on http://{SERVE_HOST}:{server.server_address[1]}/")
+        return server
+
+    def watch(self, stop=None):
+        # polls until stop (a threading.Event) is set or ctrl-c
+        stop = stop or threading.Event()
+        server = self.serve(self.options["SERVE_PORT"]) if self.options["SERVE_PORT"] else None
+        try:
+            while True:
+                try:
+                    self.poll()
+                except Exception as e:
+                    # any failure of a poll or rerun, fetch errors, a bad sheet or a bug in a stage, leaves the last
+                    # good results being served and is shown on /status until a rerun succeeds
+                    print(f"Poll failed, keeping the previous results: {type(e).__name__}: {e}")
+                    with self.lock:
+                        self.status["error"] = f"{type(e).__name__}: {e}"
+                if stop.wait(self.options["WATCH_INTERVAL"]):
+                    break
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
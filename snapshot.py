@@ -0,0 +1,179 @@
+import pickle
+import pandas as pd
+
+
+# mergeable aggregate of the grouped results: {(combo..., result): [count, first row]} as built by
+# Dataset.combo_result_counts, saved as a pickle. a new batch of cleaned rows is folded in without rereading the
+# earlier ones, snapshots add and subtract, and a RollingWindow keeps e.g. the last 30 days up to date from daily ones
+
+SNAPSHOT_VERSION = 1
+
+KEY_COLUMNS = ["Parent 1 Species", "Parent 1 Level", "Parent 2 Species", "Parent 2 Level", "Torches", "Skin", "Result"]
+
+
+def _column(values):
+    # plain python values with missing ones as None, so keys hash and compare the same after a reload
+    values = values.astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+class AggregateSnapshot:
+
+    def __init__(self, counts=None, rows=0):
+        self.counts = counts if counts is not None else {}
+        self.rows = rows  # rows numbered so far, a folded batch is numbered from here
+
+    @classmethod
+    def from_counts(cls, counts, rows):
+        # a Dataset.combo_result_counts frame over rows rows
+        snapshot = cls(rows=rows)
+        snapshot._add_counts(counts)
+        return snapshot
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        return cls.from_counts(dataset.combo_result_counts(), len(dataset.df))
+
+    @classmethod
+    def by_day(cls, dataset):
+        # {day: snapshot of that day's rows}, first rows stay positions in the whole dataset so the days add back up
+        # to from_dataset's snapshot
+        days = dataset.date_col.dt.normalize()
+        snapshots = {}
+        for day, positions in sorted(dataset.df.groupby(days, sort=False).indices.items()):
+            part = type(dataset).from_frame(dataset.df.iloc[positions].reset_index(drop=True), dataset.schema)
+            counts = part.combo_result_counts()
+            counts["first"] = positions[counts["first"].to_numpy()]
+            snapshots[day] = cls.from_counts(counts, len(dataset.df))
+        return snapshots
+
+    def _add_counts(self, counts):
+        keys = zip(*(_column(counts[col]) for col in KEY_COLUMNS))
+        for key, count, first in zip(keys, counts["count"].tolist(), counts["first"].tolist()):
+            entry = self.counts.get(key)
+            if entry is None:
+                self.counts[key] = [count, first]
+            else:
+                entry[0] += count
+                entry[1] = min(entry[1], first)
+
+    def fold(self, dataset):
+        # adds a batch of new cleaned rows (a Dataset), in time proportional to the batch
+        self._add_counts(dataset.combo_result_counts(self.rows))
+        self.rows += len(dataset.df)
+        return self
+
+    def copy(self):
+        return AggregateSnapshot({key: list(entry) for key, entry in self.counts.items()}, self.rows)
+
+    def __iadd__(self, other):
+        # first rows are taken as numbered the same way in both, e.g. days split by by_day or batches of one stream,
+        # otherwise the grouped results just list the combos in some other order
+        for key, (count, first) in other.counts.items():
+            entry = self.counts.get(key)
+            if entry is None:
+                self.counts[key] = [count, first]
+            else:
+                entry[0] += count
+                entry[1] = min(entry[1], first)
+        self.rows = max(self.rows, other.rows)
+        return self
+
+    def __isub__(self, other):
+        # removes rows that were added into this snapshot, e.g. a day that fell out of a window. combos keep their
+        # first row so the grouped results' order doesn't change
+        # every count is checked before any is changed, so a failed subtraction leaves the snapshot as it was
+        remaining = {}
+        for key, (count, _) in other.counts.items():
+            entry = self.counts.get(key)
+            if entry is None or entry[0] < count:
+                raise ValueError(f"can't subtract {count} of {key}, the snapshot only has {entry[0] if entry else 0}")
+            remaining[key] = entry[0] - count
+        for key, count in remaining.items():
+            if count:
+                self.counts[key][0] = count
+            else:
+                del self.counts[key]
+        return self
+
+    def __add__(self, other):
+        total = self.copy()
+        total += other
+        return total
+
+    def __sub__(self, other):
+        total = self.copy()
+        total -= other
+        return total
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __eq__(self, other):
+        return isinstance(other, AggregateSnapshot) and self.counts == other.counts
+
+    def total_breeds(self):
+        return sum(count for count, _ in self.counts.values())
+
+    def to_counts(self):
+        # back to a combo_result_counts frame, for Dataset.grouped_results / OutcomeIndex
+        counts = pd.DataFrame(list(self.counts.keys()), columns=KEY_COLUMNS)
+        counts["count"] = [count for count, _ in self.counts.values()]
+        counts["first"] = [first for _, first in self.counts.values()]
+        return counts
+
+    def export_grouped(self, output_file="grouped_results.csv"):
+        # same csv as Dataset.export_results_grouped_by_combo
+        import Dataset
+        Dataset.Dataset.grouped_results(self.to_counts()).to_csv(output_file, index=False)
+
+    def save(self, snapshot_file):
+        with open(snapshot_file, "wb") as f:
+            pickle.dump((SNAPSHOT_VERSION, self.rows, self.counts), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, snapshot_file):
+        with open(snapshot_file, "rb") as f:
+            version, rows, counts = pickle.load(f)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"{snapshot_file} is a version {version} snapshot, expected {SNAPSHOT_VERSION}")
+        return cls(counts, rows)
+
+
+class RollingWindow:
+    # aggregate of the last days days, moved forward by adding new daily snapshots and subtracting those that fell out,
+    # each step costs the size of the days added and removed rather than of the whole window
+
+    def __init__(self, days):
+        self.days = days
+        self.daily = {}
+        self.total = AggregateSnapshot()
+
+    def add(self, day, snapshot):
+        day = pd.Timestamp(day).normalize()
+        self.daily[day] = self.daily[day] + snapshot if day in self.daily else snapshot.copy()
+        self.total += snapshot
+        cutoff = max(self.daily) - pd.Timedelta(days=self.days - 1)
+        for old in [d for d in self.daily if d < cutoff]:
+            self.total -= self.daily.pop(old)
+        return self
+
+    def update(self, daily):
+        # adds a {day: snapshot} dict such as AggregateSnapshot.by_day's, in date order
+        for day in sorted(daily):
+            self.add(day, daily[day])
+        return self
+
+    def save(self, window_file):
+        with open(window_file, "wb") as f:
+            pickle.dump((SNAPSHOT_VERSION, self.days, self.daily, self.total), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, window_file):
+        with open(window_file, "rb") as f:
+            version, days, daily, total = pickle.load(f)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f"{window_file} is a version {version} window, expected {SNAPSHOT_VERSION}")
+        window = cls(days)
+        window.daily, window.total = daily, total
+        return window
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import sqlite3
+import pandas as pd
+import numpy as np
+
+
+# sqlite store used by main.py's incremental mode
+# one row per sheet row: its position, a hash of the raw flattened content, the rules it violated and the cleaned
+# row (null if it was dropped). positions are the row numbers of the flattened sheet, which only grows by appending
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS rows (
+    position INTEGER PRIMARY KEY,
+    hash INTEGER NOT NULL,
+    violations TEXT NOT NULL,
+    cleaned TEXT
+);
+CREATE TABLE IF NOT EXISTS pseudonyms (name TEXT PRIMARY KEY, pseudonym TEXT NOT NULL, idx INTEGER NOT NULL);
+"""
+
+
+# one 64 bit hash per row of the raw content, values are hashed as text so dtype inference can't change the hash
+def row_hashes(df):
+    hashes = pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().view(np.int64)
+    return pd.Series(hashes, index=df.index)
+
+
+# anything that changes how rows are cleaned invalidates every stored verdict, so it all goes into one fingerprint
+def options_fingerprint(*parts):
+    text = json.dumps(parts, default=str, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_digest(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+class StateStore:
+
+    def __init__(self, db_file):
+        self.conn = sqlite3.connect(db_file)
+        self.conn.executescript(SCHEMA)
+
+    def get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def fingerprint(self):
+        return self.get_meta("fingerprint")
+
+    def reset(self, fingerprint):
+        # pseudonyms are kept so sources keep the same player numbers after a rebuild
+        self.conn.execute("DELETE FROM rows")
+        self.conn.execute("DELETE FROM meta")
+        self.set_meta("fingerprint", fingerprint)
+        self.conn.commit()
+
+    def row_count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def changed_rows(self, hashes):
+        # positions (ascending) whose hash is new or different to the stored one
+        stored = pd.read_sql_query("SELECT position, hash FROM rows", self.conn, index_col="position")["hash"]
+        # compared as nullable Int64, a plain reindex turns the hashes into float64 once a row is new and rounds them
+        stored = stored.astype("Int64").reindex(hashes.index)
+        changed = stored.ne(hashes.astype("Int64")).fillna(True).to_numpy(dtype=bool)
+        return hashes.index[changed].tolist()
+
+    def update_rows(self, positions, hashes, violations, cleaned):
+        # cleaned holds the cleaned rows indexed by position, positions missing from it were dropped
+        clean_json = {}
+        if len(cleaned):
+            values = cleaned.astype(object).where(cleaned.notna(), None).values.tolist()
+            clean_json = {position: json.dumps(row) for position, row in zip(cleaned.index, values)}
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO rows (position, hash, violations, cleaned) VALUES (?, ?, ?, ?)",
+            [(int(position), int(row_hash), ",".join(rules), clean_json.get(position))
+             for position, row_hash, rules in zip(positions, hashes, violations)],
+        )
+
+    def failing_rows(self):
+        # {position: [rule names]} of every stored row that violated a rule, ascending
+        rows = self.conn.execute("SELECT position, violations FROM rows WHERE violations != '' ORDER BY position").fetchall()
+        return {position: violations.split(",") for position, violations in rows}
+
+    def truncate(self, row_count):
+        # the sheet got shorter, forget rows past the end
+        self.conn.execute("DELETE FROM rows WHERE position >= ?", (int(row_count),))
+
+    def set_columns(self, columns):
+        self.set_meta("columns", json.dumps(list(columns)))
+
+    def cleaned_frame(self):
+        columns = json.loads(self.get_meta("columns") or "[]")
+        rows = self.conn.execute("SELECT cleaned FROM rows WHERE cleaned IS NOT NULL ORDER BY position").fetchall()
+        return pd.DataFrame([json.loads(row[0]) for row in rows], columns=columns)
+
+    def pseudonyms(self):
+        rows = self.conn.execute("SELECT name, pseudonym FROM pseudonyms ORDER BY idx").fetchall()
+        return dict(rows)
+
+    def set_pseudonyms(self, name_map):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO pseudonyms (name, pseudonym, idx) VALUES (?, ?, ?)",
+            [(name, pseudonym, idx) for idx, (name, pseudonym) in enumerate(name_map.items())],
+        )
+
+    # the export is only patched by appending if it is still the file written by the last incremental run
+    def export_matches(self, csv_file):
+        if not os.path.exists(csv_file):
+            return False
+        stat = os.stat(csv_file)
+        return self.get_meta("export") == f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def record_export(self, csv_file):
+        stat = os.stat(csv_file)
+        self.set_meta("export", f"{stat.st_size}:{stat.st_mtime_ns}")
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()